@@ -0,0 +1,215 @@
+from sklearn.cluster import MiniBatchKMeans
+from pathlib import Path
+import numpy as np
+import json
+import logging
+
+# embedding rows scored at once: memory is O(block_size x queries)
+BLOCK_SIZE = 8192
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def save_embeddings(topic_doc_matrix, doc_ids, store_dir: Path, block_size=BLOCK_SIZE):
+    """Saves the documents embeddings (columns of `topic_doc_matrix`, as
+    returned by `lsa_compute`) as a (documents x topics) float32 .npy file,
+    with rows normalized to unit length, so that dot products are cosine
+    similarities. The documents are written in blocks of `block_size`.
+
+    Args:
+        topic_doc_matrix (matrix): lsa topics as documents-embedding
+        doc_ids (list): documents IDs, in column order
+        store_dir (Path): directory where the embeddings are saved
+    """
+    logging.info(f"Saving documents embeddings to {store_dir}")
+    store_dir.mkdir(parents=True, exist_ok=True)
+    n_topics, n_docs = topic_doc_matrix.shape
+    embeddings = np.lib.format.open_memmap(
+        store_dir / Path("embeddings.npy"), mode="w+", dtype=np.float32, shape=(n_docs, n_topics)
+    )
+    for start in range(0, n_docs, block_size):
+        block = np.asarray(topic_doc_matrix[:, start : start + block_size]).T
+        embeddings[start : start + block_size] = normalize_rows(block)
+    embeddings.flush()
+    with open(store_dir / Path("doc_ids.json"), "w") as f_stream:
+        json.dump(list(doc_ids), f_stream)
+
+
+def load_embeddings(store_dir: Path):
+    """Opens the embeddings saved with `save_embeddings`, memory-mapped.
+
+    Returns:
+        tuple of (documents x topics) embeddings, documents IDs
+    """
+    embeddings = np.load(store_dir / Path("embeddings.npy"), mmap_mode="r")
+    with open(store_dir / Path("doc_ids.json")) as f_stream:
+        doc_ids = json.load(f_stream)
+    return embeddings, doc_ids
+
+
+def merge_top_k(scores, indexes, new_scores, new_indexes, k):
+    """Merges two (queries x candidates) top-k lists, returning the k best
+    candidates per query (not sorted)."""
+    scores = np.hstack([scores, new_scores])
+    indexes = np.hstack([indexes, new_indexes])
+    if scores.shape[1] <= k:
+        return scores, indexes
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, top, axis=1), np.take_along_axis(indexes, top, axis=1)
+
+
+def sort_top_k(scores, indexes):
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indexes, order, axis=1)
+
+
+def top_k(queries, embeddings, k=10, block_size=BLOCK_SIZE, exclude=None):
+    """Exact top-k cosine similarity search.
+
+    The embeddings are scored block by block against all the queries (one
+    matrix product per block), keeping only the running top k per query,
+    so memory stays bounded for any corpus size, and a memory-mapped
+    `embeddings` matrix is read sequentially once.
+
+    Args:
+        queries (matrix): (queries x topics) query embeddings
+        embeddings (matrix): (documents x topics) normalized embeddings
+        k (int, optional): neighbours per query. Defaults to 10.
+        block_size (int, optional): documents scored at once.
+        exclude (array, optional): document index to exclude for each query
+            (e.g. the query document itself). Defaults to None.
+
+    Returns:
+        tuple of (queries x k) similarities and document indexes, best first
+    """
+    queries = normalize_rows(np.atleast_2d(queries))
+    n_queries = queries.shape[0]
+    scores = np.empty((n_queries, 0), dtype=np.float32)
+    indexes = np.empty((n_queries, 0), dtype=np.int64)
+    for start in range(0, embeddings.shape[0], block_size):
+        block = np.asarray(embeddings[start : start + block_size])
+        block_scores = queries @ block.T
+        if exclude is not None:
+            local = np.asarray(exclude) - start
+            inside = np.flatnonzero((local >= 0) & (local < block.shape[0]))
+            block_scores[inside, local[inside]] = -np.inf
+        block_indexes = np.broadcast_to(np.arange(start, start + block.shape[0]), block_scores.shape)
+        if block_scores.shape[1] > k:
+            top = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+            block_scores = np.take_along_axis(block_scores, top, axis=1)
+            block_indexes = np.take_along_axis(block_indexes, top, axis=1)
+        scores, indexes = merge_top_k(scores, indexes, block_scores, block_indexes, k)
+    return sort_top_k(scores, indexes)
+
+
+def all_pairs_top_k(embeddings, k=10, batch_size=1024, block_size=BLOCK_SIZE):
+    """Top-k most similar documents of every document in the corpus
+    (the document itself excluded), computed by batches of `batch_size` queries.
+
+    Returns:
+        tuple of (documents x k) similarities and document indexes, best first
+    """
+    n_docs = embeddings.shape[0]
+    scores = np.empty((n_docs, min(k, n_docs - 1)), dtype=np.float32)
+    indexes = np.empty(scores.shape, dtype=np.int64)
+    for start in range(0, n_docs, batch_size):
+        batch = np.arange(start, min(start + batch_size, n_docs))
+        scores[batch], indexes[batch] = top_k(
+            embeddings[start : start + batch_size], embeddings, scores.shape[1], block_size, exclude=batch
+        )
+        logging.info(f"{batch[-1] + 1}/{n_docs} documents searched")
+    return scores, indexes
+
+
+def similar_patents(doc_id, embeddings, doc_ids, k=10, index=None):
+    """Returns the k documents most similar to `doc_id`, as a list of
+    (ID, similarity), best first. The search is exact, or approximate if
+    `index` (an `IvfIndex` of `embeddings`) is given."""
+    position = doc_ids.index(doc_id)
+    query = embeddings[position : position + 1]
+    if index is None:
+        scores, indexes = top_k(query, embeddings, k, exclude=[position])
+    else:
+        scores, indexes = index.search(query, embeddings, k + 1)
+    return [
+        (doc_ids[i], float(s)) for s, i in zip(scores[0], indexes[0]) if i not in (position, -1)
+    ][:k]
+
+
+class IvfIndex:
+    """Approximate nearest neighbours index (inverted file).
+
+    The embeddings are clustered with k-means in `n_lists` lists. A query
+    is only scored against the documents of the `n_probe` lists whose
+    centroids are the most similar to it, so query time is sub-linear in
+    the corpus size, at the cost of missing some neighbours (recall grows
+    with `n_probe`).
+
+    Args:
+        n_lists (int, optional): number of clusters. Defaults to 100.
+        n_probe (int, optional): clusters searched per query. Defaults to 8.
+    """
+
+    def __init__(self, n_lists=100, n_probe=8):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        self.list_offsets = None
+        self.list_docs = None
+
+    def fit(self, embeddings, random_state=0):
+        """Clusters the (documents x topics) normalized embeddings."""
+        logging.info(f"Building IVF index ({self.n_lists} lists)...")
+        kmeans = MiniBatchKMeans(n_clusters=self.n_lists, random_state=random_state)
+        labels = kmeans.fit_predict(np.asarray(embeddings))
+        self.centroids = normalize_rows(kmeans.cluster_centers_)
+        # documents sorted by list: list l is list_docs[list_offsets[l]:list_offsets[l + 1]]
+        self.list_docs = np.argsort(labels, kind="stable")
+        self.list_offsets = np.searchsorted(labels[self.list_docs], np.arange(self.n_lists + 1))
+        return self
+
+    def search(self, queries, embeddings, k=10):
+        """Approximate top-k cosine similarity search (see `top_k`).
+
+        Returns:
+            tuple of (queries x k) similarities and document indexes, best first.
+            Missing neighbours (fewer than k candidates) have index -1.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        n_probe = min(self.n_probe, self.n_lists)
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        indexes = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for q, query in enumerate(queries):
+            candidates = np.concatenate(
+                [self.list_docs[self.list_offsets[p] : self.list_offsets[p + 1]] for p in probes[q]]
+            )
+            candidates.sort()
+            candidate_scores = np.asarray(embeddings[candidates]) @ query
+            n = min(k, len(candidates))
+            top = np.argpartition(-candidate_scores, n - 1)[:n] if n else []
+            scores[q, :n] = candidate_scores[top]
+            indexes[q, :n] = candidates[top]
+        return sort_top_k(scores, indexes)
+
+    def save(self, store_dir: Path):
+        np.savez(
+            store_dir / Path("ivf_index.npz"),
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_docs=self.list_docs,
+            n_probe=self.n_probe,
+        )
+
+    @classmethod
+    def load(cls, store_dir: Path):
+        data = np.load(store_dir / Path("ivf_index.npz"))
+        index = cls(len(data["centroids"]), int(data["n_probe"]))
+        index.centroids = data["centroids"]
+        index.list_offsets = data["list_offsets"]
+        index.list_docs = data["list_docs"]
+        return index
@@ -1,26 +1,53 @@
 from sklearn.decomposition import non_negative_factorization
 from sklearn.utils.extmath import randomized_svd
+from threadpoolctl import threadpool_limits
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import issparse
 import logging
+import inspect
+import os
 from pathlib import Path
 import numpy as np
 
-def lsa_compute_cached(*args, cache_dir, **kwargs):
+from utils.artifact_cache import ArtifactCache, fingerprint_matrix
+
+# ks per NMF warm-start chain in `lsa_sweep`
+NMF_CHAIN_LENGTH = 4
+# `nmf_options` which do not change the NMF output, left out of the cache key
+NMF_UNKEYED_OPTIONS = ("callback", "threads")
+
+def lsa_compute_cached(*args, cache_dir, max_cache_bytes=None, **kwargs):
     """Wrapper for `lsa_compute`. It loads a cached result if present,
     otherwise, it calls `lsa_compute` and caches the result.
 
+    Results are cached in an `ArtifactCache`, keyed on the fingerprint of
+    `word_doc_matrix` and on all the `lsa_compute` parameters, apart from
+    the `nmf_options` which do not change the output (`NMF_UNKEYED_OPTIONS`).
+
     Args:
         cache_dir (Path object): Path to cache dir.
+        max_cache_bytes (int, optional): disk budget of the cache. Defaults to None (no limit).
     """
-    lsa_dir = cache_dir / Path('LSA_' + kwargs['method'])
-    if lsa_dir.exists():
-        return lsa_load(lsa_dir)
-    else:
-        word_topic_matrix, topic_doc_matrix = lsa_compute(*args, **kwargs)
-        lsa_save(lsa_dir, word_topic_matrix, topic_doc_matrix)
-        return word_topic_matrix, topic_doc_matrix
+    params = inspect.signature(lsa_compute).bind(*args, **kwargs)
+    params.apply_defaults()
+    params = dict(params.arguments)
+    word_doc_matrix = params.pop("word_doc_matrix")
+    if params["nmf_options"] is not None:
+        params["nmf_options"] = {
+            name: value for name, value in params["nmf_options"].items() if name not in NMF_UNKEYED_OPTIONS
+        }
 
+    cache = ArtifactCache(cache_dir, max_cache_bytes)
+    key = cache.key(matrix=fingerprint_matrix(word_doc_matrix), **params)
+    cached = cache.get("LSA", key, lsa_load)
+    if cached is not None:
+        return cached
+    word_topic_matrix, topic_doc_matrix = lsa_compute(*args, **kwargs)
+    cache.put("LSA", key, lsa_save, word_topic_matrix, topic_doc_matrix)
+    return word_topic_matrix, topic_doc_matrix
 
-def lsa_compute(word_doc_matrix, n_topics: int, method='SVD', max_nmf_iter=10):
+
+def lsa_compute(word_doc_matrix, n_topics: int, method='SVD', max_nmf_iter=10, nmf_options: dict = None):
     """
     Computes lsa on word_doc_matrix, using factorization functions from `sklearn`.
     If `method` is "SVD" (default), it will use `randomized_svd`.
@@ -32,6 +59,9 @@ def lsa_compute(word_doc_matrix, n_topics: int, method='SVD', max_nmf_iter=10):
         method (str): factorization method
         max_nmf_iter (int, optional): Sets the max number of iterations
             when calling `non_negative_factorization`. Default is 10.
+        nmf_options (dict, optional): If set, NMF is computed by `LSA.nmf.nmf_compute`
+            (with max_iter=max_nmf_iter), passing these options: solver, sparse,
+            dtype, tol, callback, threads.
 
     Returns:
         tuple of word_topic_matrix, topic_doc_matrix
@@ -42,6 +72,11 @@ def lsa_compute(word_doc_matrix, n_topics: int, method='SVD', max_nmf_iter=10):
     if method == "SVD":
         U, _, VT = randomized_svd(word_doc_matrix, n_topics)
         return U, VT
+    elif method == "NMF" and nmf_options is not None:
+        from LSA.nmf import nmf_compute
+
+        W, H, _ = nmf_compute(word_doc_matrix, n_topics, max_iter=max_nmf_iter, **nmf_options)
+        return W, H
     elif method == "NMF":
         W, H, _ = non_negative_factorization(
             word_doc_matrix,
@@ -54,6 +89,107 @@ def lsa_compute(word_doc_matrix, n_topics: int, method='SVD', max_nmf_iter=10):
         raise ValueError(f"ERROR: invalid value for method argument")
 
 
+def reconstruction_error(word_doc_matrix, word_topic_matrix, topic_doc_matrix):
+    """Frobenius norm of word_doc_matrix - word_topic_matrix @ topic_doc_matrix,
+    computed without forming the (dense) product."""
+    X, W, H = word_doc_matrix, word_topic_matrix, topic_doc_matrix
+    X_norm2 = X.multiply(X).sum() if issparse(X) else np.sum(X * X)
+    cross = np.sum(np.asarray(W.T @ X) * H)
+    WW_HH = np.sum((W.T @ W) * (H @ H.T))
+    return np.sqrt(max(X_norm2 - 2 * cross + WW_HH, 0))
+
+
+def nmf_chain(word_doc_matrix, n_topics_list, max_nmf_iter=10, threads=1):
+    """Runs NMF for every k in `n_topics_list` (ascending), starting each k from
+    the solution of the previous one, padded with small random components.
+    BLAS threads are limited to `threads`.
+
+    Returns:
+        dict: k -> (word_topic_matrix, topic_doc_matrix, reconstruction error)
+    """
+    rng = np.random.RandomState(0)
+    scale = np.sqrt(word_doc_matrix.mean() / max(n_topics_list))
+    results = {}
+    W = np.zeros((word_doc_matrix.shape[0], 0))
+    H = np.zeros((0, word_doc_matrix.shape[1]))
+    with threadpool_limits(limits=threads):
+        for k in n_topics_list:
+            new = k - W.shape[1]
+            W_init = np.hstack([W, scale * rng.rand(W.shape[0], new)])
+            H_init = np.vstack([H, scale * rng.rand(new, H.shape[1])])
+            W, H, _ = non_negative_factorization(
+                word_doc_matrix,
+                W=W_init,
+                H=H_init,
+                n_components=k,
+                init="custom",
+                max_iter=max_nmf_iter,
+            )
+            results[k] = (W, H, reconstruction_error(word_doc_matrix, W, H))
+    return results
+
+
+def lsa_sweep(
+    word_doc_matrix,
+    n_topics_list,
+    method="SVD",
+    max_nmf_iter=10,
+    n_threads=None,
+    chain_length=NMF_CHAIN_LENGTH,
+):
+    """Computes lsa on word_doc_matrix for every number of topics in `n_topics_list`.
+
+    With "SVD", a single `randomized_svd` is computed at the largest k,
+    and every smaller k is obtained by truncation.
+    With "NMF", the ks are split in interleaved chains of about `chain_length`
+    ks; within a chain, each k is warm-started from the previous solution
+    (see `nmf_chain`). The chains only depend on `n_topics_list` and
+    `chain_length`, so the results do not depend on the machine; they are
+    run in (at most `n_threads`) parallel processes, sharing the `n_threads`
+    budget, so they do not oversubscribe the cpus.
+
+    Args:
+        word_doc_matrix (matrix): matrix to factorize
+        n_topics_list (list): numbers of "topics" to extract
+        method (str): factorization method
+        max_nmf_iter (int, optional): max number of NMF iterations per k. Default is 10.
+        n_threads (int, optional): total thread budget. Defaults to the number of cpus.
+        chain_length (int, optional): ks per NMF chain. Defaults to `NMF_CHAIN_LENGTH`.
+
+    Returns:
+        dict: k -> (word_topic_matrix, topic_doc_matrix, reconstruction error)
+    """
+    n_topics_list = sorted(set(n_topics_list))
+    logging.info(f"Computing LSA sweep over {len(n_topics_list)} values using {method} method...")
+
+    if method == "SVD":
+        U, S, VT = randomized_svd(word_doc_matrix, n_topics_list[-1], random_state=0)
+        X = word_doc_matrix
+        X_norm2 = X.multiply(X).sum() if issparse(X) else np.sum(X * X)
+        return {
+            k: (U[:, :k], VT[:k], np.sqrt(max(X_norm2 - np.sum(S[:k] ** 2), 0)))
+            for k in n_topics_list
+        }
+    elif method == "NMF":
+        # interleaved chains have similar costs
+        n_chains = -(-len(n_topics_list) // chain_length)
+        chains = [n_topics_list[i::n_chains] for i in range(n_chains)]
+        n_threads = n_threads or os.cpu_count()
+        n_jobs = min(n_threads, n_chains)
+        threads = max(1, n_threads // n_jobs)
+        results = {}
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = [
+                executor.submit(nmf_chain, word_doc_matrix, chain, max_nmf_iter, threads)
+                for chain in chains
+            ]
+            for future in futures:
+                results.update(future.result())
+        return dict(sorted(results.items()))
+    else:
+        raise ValueError("ERROR: invalid value for method argument")
+
+
 def lsa_save(lsa_dir: Path, word_topic_matrix, topic_doc_matrix):
     """Save output computed by `lsa_compute` with method `method`.
 
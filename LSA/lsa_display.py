@@ -1,6 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from LSA.topic_analytics import top_word_indexes, topic_assignment_counts
+
 
 
 def get_topic_words(word_topic_matrix, words, N=3):
@@ -8,15 +10,8 @@ def get_topic_words(word_topic_matrix, words, N=3):
     Returns the top N words of each topic.
     """
     words = np.array(words)
-    n_topics = word_topic_matrix.shape[1]
-    topic_top_words = []
-    # print('Printing top-{N} words for each topic:')
-    for topic in range(n_topics):
-        top_words_indexes = word_topic_matrix[:,topic].argsort(axis=0)[-N:]
-        top_words = words[top_words_indexes]
-        topic_top_words.append(top_words)
-        # print(f"Topic {topic}: {' '.join(top_words)}")
-    return topic_top_words
+    top_words_indexes = top_word_indexes(word_topic_matrix, N)
+    return list(words[top_words_indexes])
 
 
 def get_topic_counts(topic_doc_matrix):
@@ -27,15 +22,7 @@ def get_topic_counts(topic_doc_matrix):
     To assign a document to a topic, it searches for the greater component
     in the topic-embedding of the document.  
     """
-    n_topics = topic_doc_matrix.shape[0]
-    document_topic = topic_doc_matrix.argmax(axis=0)
-    document_topic = list(document_topic)
-    # count the number of documents belonging to each topic
-    topic_count = []
-    for topic in range(n_topics):
-        n_assigned = document_topic.count(topic)
-        topic_count.append(n_assigned)
-    return topic_count
+    return list(topic_assignment_counts(topic_doc_matrix))
 
 def plot_lsa(topic_words, topic_counts, N=-1):
     """Plot the number of documents assigned to each topic.
@@ -0,0 +1,147 @@
+from sklearn.decomposition import non_negative_factorization
+from sklearn.utils.extmath import randomized_svd
+from scipy.sparse import issparse
+from pathlib import Path
+import numpy as np
+import logging
+
+
+def iter_col_batches(matrix, batch_size: int):
+    """Yields the columns of `matrix` in batches of `batch_size`."""
+    matrix = matrix.tocsc() if issparse(matrix) else matrix
+    for start in range(0, matrix.shape[1], batch_size):
+        yield matrix[:, start : start + batch_size]
+
+
+def to_dense(matrix):
+    return matrix.toarray() if issparse(matrix) else np.asarray(matrix)
+
+
+class LsaModel:
+    """LSA model, keeping the factors of the word-document matrix, so new
+    documents can be projected in its topic space or added to it without
+    refactorizing the whole matrix.
+
+    With method "SVD", word_doc_matrix ~ U diag(S) VT.
+    With method "NMF", word_doc_matrix ~ W H.
+    `factors()` returns (U, VT) or (W, H), as `lsa_compute`.
+
+    Args:
+        n_topics (int): number of "topics" to extract
+        method (str): factorization method, "SVD" (default) or "NMF"
+        max_nmf_iter (int, optional): max number of NMF iterations. Default is 10.
+    """
+
+    def __init__(self, n_topics: int, method="SVD", max_nmf_iter=10):
+        if method not in ("SVD", "NMF"):
+            raise ValueError("ERROR: invalid value for method argument")
+        self.n_topics = n_topics
+        self.method = method
+        self.max_nmf_iter = max_nmf_iter
+        self.word_topic_matrix = None
+        self.singular_values = None
+        self.topic_doc_matrix = None
+
+    def fit(self, word_doc_matrix):
+        """Factorizes `word_doc_matrix`, as `lsa_compute`."""
+        logging.info(f"Computing LSA using {self.method} method...")
+        if self.method == "SVD":
+            U, S, VT = randomized_svd(word_doc_matrix, self.n_topics, random_state=0)
+            self.word_topic_matrix, self.singular_values, self.topic_doc_matrix = U, S, VT
+        else:
+            W, H, _ = non_negative_factorization(
+                word_doc_matrix,
+                n_components=self.n_topics,
+                max_iter=self.max_nmf_iter,
+                random_state=0,
+            )
+            self.word_topic_matrix, self.topic_doc_matrix = W, H
+        return self
+
+    def factors(self):
+        """Returns word_topic_matrix, topic_doc_matrix"""
+        return self.word_topic_matrix, self.topic_doc_matrix
+
+    def transform(self, new_word_doc_matrix, batch_size=10000):
+        """Folds new documents (columns of a word-document matrix over the same
+        words) into the topic space, without changing the model.
+
+        With SVD, the embedding is diag(1/S) U^T x. With NMF, it is the
+        non-negative solution h of x ~ W h, with W fixed.
+
+        Returns:
+            topic_doc_matrix of the new documents
+        """
+        batches = [self._fold_in(batch) for batch in iter_col_batches(new_word_doc_matrix, batch_size)]
+        return np.hstack(batches)
+
+    def update(self, new_word_doc_matrix, batch_size=10000):
+        """Adds new documents to the model, in batches of `batch_size`.
+
+        With SVD, the factorization is updated with Brand's incremental SVD,
+        at a cost linear in the batch size, and the topics adapt to the new
+        documents. With NMF, W is kept fixed and the new documents are
+        folded in (see `transform`).
+        """
+        for batch in iter_col_batches(new_word_doc_matrix, batch_size):
+            if self.method == "SVD":
+                self._svd_update(batch)
+            else:
+                self.topic_doc_matrix = np.hstack([self.topic_doc_matrix, self._fold_in(batch)])
+        return self
+
+    def _fold_in(self, batch):
+        if self.method == "SVD":
+            projection = self.word_topic_matrix.T @ batch
+            return to_dense(projection) / self.singular_values[:, None]
+        H_T, _, _ = non_negative_factorization(
+            batch.T,
+            H=self.word_topic_matrix.T,
+            n_components=self.n_topics,
+            update_H=False,
+            max_iter=self.max_nmf_iter * 20,
+            random_state=0,
+        )
+        return H_T.T
+
+    def _svd_update(self, batch):
+        """Brand's rank-k update of U diag(S) VT with the new columns `batch`."""
+        U, S, VT = self.word_topic_matrix, self.singular_values, self.topic_doc_matrix
+        k = len(S)
+        C = to_dense(batch)
+        L = U.T @ C
+        # component of the new columns orthogonal to the current topics
+        J, K = np.linalg.qr(C - U @ L)
+        c = C.shape[1]
+        middle = np.block([[np.diag(S), L], [np.zeros((K.shape[0], k)), K]])
+        Um, Sm, VmT = np.linalg.svd(middle, full_matrices=False)
+        self.word_topic_matrix = np.hstack([U, J]) @ Um[:, :k]
+        self.singular_values = Sm[:k]
+        # [[VT, 0], [0, I]] rotated by the small svd
+        self.topic_doc_matrix = np.hstack([VmT[:k, :k] @ VT, VmT[:k, k:k + c]])
+
+    def save(self, model_dir: Path):
+        """Saves the model factors in `model_dir`."""
+        logging.info(f"Saving LSA model to {model_dir}")
+        model_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            model_dir / Path("lsa_model.npz"),
+            word_topic_matrix=self.word_topic_matrix,
+            topic_doc_matrix=self.topic_doc_matrix,
+            singular_values=self.singular_values if self.singular_values is not None else [],
+            params=[self.n_topics, self.max_nmf_iter],
+            method=self.method,
+        )
+
+    @classmethod
+    def load(cls, model_dir: Path):
+        """Loads a model saved with `save`."""
+        print(f"Loading LSA model from \n {model_dir}")
+        data = np.load(model_dir / Path("lsa_model.npz"))
+        n_topics, max_nmf_iter = data["params"]
+        model = cls(int(n_topics), str(data["method"]), int(max_nmf_iter))
+        model.word_topic_matrix = data["word_topic_matrix"]
+        model.topic_doc_matrix = data["topic_doc_matrix"]
+        if model.method == "SVD":
+            model.singular_values = data["singular_values"]
+        return model
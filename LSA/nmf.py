@@ -0,0 +1,113 @@
+from threadpoolctl import threadpool_limits
+from scipy.sparse import issparse
+import numpy as np
+import logging
+import time
+
+# avoids divisions by zero in the updates
+EPSILON = np.finfo(np.float32).eps
+
+
+def nmf_compute(
+    word_doc_matrix,
+    n_topics: int,
+    solver="cd",
+    sparse=True,
+    dtype=np.float32,
+    max_iter=200,
+    tol=1e-4,
+    callback=None,
+    threads=None,
+    random_state=0,
+):
+    """Factorizes word_doc_matrix ~ W H with NMF, monitoring convergence.
+
+    The solver updates are run directly on the validated input, one
+    iteration at a time. Every iteration updates H then W, and computes the
+    loss (Frobenius reconstruction error) of (W, H) after the H update from
+    the Gram terms W^T X, W^T W and H H^T, which the updates need anyway,
+    so monitoring adds no product with X. The loss is passed to `callback`
+    and checked for early stopping: the run stops when the relative loss
+    decrease is below `tol`.
+
+    Args:
+        word_doc_matrix (matrix): matrix to factorize
+        n_topics (int): number of "topics" to extract
+        solver (str, optional): "cd" (coordinate descent, one component at a
+            time, as HALS, default) or "mu" (multiplicative update).
+        sparse (bool, optional): If True (default), a sparse input is kept sparse.
+            Otherwise, it is densified, which can be faster for small matrices.
+        dtype (type, optional): float type of the computation. Defaults to np.float32.
+        max_iter (int, optional): max number of iterations. Defaults to 200.
+        tol (float, optional): relative tolerance for early stopping. Defaults to 1e-4.
+        callback (callable, optional): called after every iteration as
+            `callback(iteration, loss, seconds)`.
+        threads (int, optional): BLAS/OpenMP threads limit. Defaults to None (no limit).
+        random_state (int, optional): seed of the random initialization. Defaults to 0.
+
+    Returns:
+        tuple of word_topic_matrix, topic_doc_matrix, history
+        (list of (iteration, loss, seconds))
+    """
+    if solver not in ("cd", "mu"):
+        raise ValueError(f"ERROR: invalid value for solver argument: {solver}")
+    X = word_doc_matrix.astype(dtype)
+    if issparse(X):
+        X = X.tocsr() if sparse else X.toarray()
+    X_T = X.T.tocsr() if issparse(X) else X.T
+    X_norm2 = X.multiply(X).sum() if issparse(X) else np.sum(X * X)
+
+    # random initialization, scaled as sklearn's init="random"
+    rng = np.random.RandomState(random_state)
+    avg = np.sqrt(X.mean() / n_topics)
+    W = np.abs(avg * rng.randn(X.shape[0], n_topics)).astype(dtype)
+    H = np.abs(avg * rng.randn(n_topics, X.shape[1])).astype(dtype)
+
+    logging.info(f"Computing NMF ({solver} solver, {n_topics} topics)...")
+    history = []
+    prev_loss = None
+    with threadpool_limits(limits=threads):
+        for iteration in range(1, max_iter + 1):
+            start = time.perf_counter()
+            WtX = np.asarray(X_T @ W).T
+            WtW = W.T @ W
+            if solver == "mu":
+                H *= WtX / np.maximum(WtW @ H, EPSILON)
+            else:
+                hals_update(H, WtW, WtX)
+            HHt = H @ H.T
+            loss = np.sqrt(max(X_norm2 - 2 * np.sum(WtX * H) + np.sum(WtW * HHt), 0))
+            XHt = np.asarray(X @ H.T)
+            if solver == "mu":
+                W *= XHt / np.maximum(W @ HHt, EPSILON)
+            else:
+                # same update as H, on the transposed problem X^T ~ H^T W^T
+                W_T = np.ascontiguousarray(W.T)
+                hals_update(W_T, HHt, XHt.T)
+                W = W_T.T
+            seconds = time.perf_counter() - start
+            history.append((iteration, loss, seconds))
+            if callback is not None:
+                callback(iteration, loss, seconds)
+            if prev_loss is not None and (prev_loss - loss) / prev_loss < tol:
+                logging.info(f"NMF converged after {iteration} iterations")
+                break
+            prev_loss = loss
+
+    return np.ascontiguousarray(W), H, history
+
+
+def hals_update(H, WtW, WtX):
+    """Coordinate descent update of H (in place), for X ~ W H with W fixed,
+    given WtW = W^T W and WtX = W^T X: every row (component) of H is set to
+    its exact non-negative least squares solution, the others being fixed."""
+    for t in range(H.shape[0]):
+        if WtW[t, t] <= 0:
+            continue
+        H[t] += (WtX[t] - WtW[t] @ H) / WtW[t, t]
+        np.maximum(H[t], 0, out=H[t])
+
+
+def log_progress(iteration, loss, seconds):
+    """`nmf_compute` callback, logging loss and time of every iteration."""
+    logging.info(f"NMF iteration {iteration}: loss {loss:.4f}, {seconds:.3f}s")
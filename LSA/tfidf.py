@@ -1,28 +1,52 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from scipy.sparse import save_npz, load_npz
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.utils import murmurhash3_32
+from scipy.sparse import save_npz, load_npz, vstack, diags, csr_matrix
 from pathlib import Path
+from itertools import islice
+import numpy as np
+import inspect
 import pickle
 import logging
 
 # from nonnegfac.nmf import NMF
 from utils import df_from_txts
+from utils.artifact_cache import ArtifactCache, fingerprint_texts
 
 # df = df["Text"].to_numpy()
 
-def tfidf_compute_cached(*args, cache_dir, **kwargs):
+def tfidf_compute_cached(*args, cache_dir, corpus_fingerprint=None, max_cache_bytes=None, **kwargs):
     """Wrapper for `tfidf_compute`. It loads a cached result if present,
     otherwise, it calls `tfidf_compute` and caches the result.
 
+    Results are cached in an `ArtifactCache`, keyed on the corpus fingerprint
+    and on all the `tfidf_compute` parameters, so results of different
+    corpora or parameters are kept side by side.
+
     Args:
         cache_dir (Path object): Path to cache dir.
+        corpus_fingerprint (str, optional): fingerprint of the corpus (e.g.
+            from `fingerprint_txts_dir`). It must be given if the corpus is a
+            lazy iterator. By default, it is computed from the corpus texts.
+        max_cache_bytes (int, optional): disk budget of the cache. Defaults to None (no limit).
     """
-    tfidf_dir = cache_dir / Path('TFIDF')
-    if tfidf_dir.exists():
-        return tfidf_load(tfidf_dir)
-    else:
-        word_document_matrix, matrix_words = tfidf_compute(*args, **kwargs)
-        tfidf_save(tfidf_dir, word_document_matrix,matrix_words)
-        return word_document_matrix, matrix_words
+    params = inspect.signature(tfidf_compute).bind(*args, **kwargs)
+    params.apply_defaults()
+    params = dict(params.arguments)
+    corpus = params.pop("corpus")
+    if corpus_fingerprint is None:
+        if not hasattr(corpus, "__len__"):
+            raise ValueError("ERROR: corpus_fingerprint is required for lazy corpora")
+        corpus_fingerprint = fingerprint_texts(corpus)
+
+    cache = ArtifactCache(cache_dir, max_cache_bytes)
+    key = cache.key(corpus=corpus_fingerprint, **params)
+    cached = cache.get("TFIDF", key, tfidf_load)
+    if cached is not None:
+        return cached
+    word_document_matrix, matrix_words = tfidf_compute(*args, **kwargs)
+    cache.put("TFIDF", key, tfidf_save, word_document_matrix, matrix_words)
+    return word_document_matrix, matrix_words
 
 
 def tfidf_compute(corpus, vocab_size=1000, stop_words: list = None):
@@ -47,6 +71,186 @@ def tfidf_compute(corpus, vocab_size=1000, stop_words: list = None):
     return document_term_matrix.transpose(), tfidf_words
 
 
+def iter_chunks(corpus, chunk_size: int):
+    """Yields lists of `chunk_size` documents from the `corpus` iterable."""
+    corpus = iter(corpus)
+    while True:
+        chunk = list(islice(corpus, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def tfidf_weight(count_matrix, df, n_docs):
+    """Turns a document-term count matrix into tfidf, as `TfidfVectorizer`
+    does with its default parameters (smoothed idf, l2 normalization)."""
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    return normalize(count_matrix @ diags(idf), norm="l2", copy=False)
+
+
+def count_terms(texts, stop_words: list = None):
+    """Counts the terms of `texts` with `CountVectorizer`.
+
+    Returns:
+        (tuple): document-term count matrix, terms (None if no term was found)
+    """
+    counter = CountVectorizer(stop_words=stop_words)
+    try:
+        counts = counter.fit_transform(texts)
+    except ValueError:
+        # only empty documents
+        return None, None
+    return counts, counter.get_feature_names()
+
+
+def update_term_stats(term_freqs: dict, doc_freqs: dict, counts, terms):
+    """Adds the term and document frequencies of a document-term count
+    matrix (see `count_terms`) to `term_freqs` and `doc_freqs`."""
+    tfs = np.asarray(counts.sum(axis=0)).ravel()
+    dfs = np.bincount(counts.indices, minlength=counts.shape[1])
+    for j, term in enumerate(terms):
+        term_freqs[term] = term_freqs.get(term, 0) + int(tfs[j])
+        doc_freqs[term] = doc_freqs.get(term, 0) + int(dfs[j])
+
+
+def corpus_term_stats(corpus, stop_words: list = None, chunk_size=1000):
+    """Term and document frequencies of every term in `corpus`,
+    counted `chunk_size` documents at a time.
+
+    Returns:
+        (tuple): term_freqs dict, doc_freqs dict, number of documents
+    """
+    term_freqs = {}
+    doc_freqs = {}
+    n_docs = 0
+    for chunk in iter_chunks(corpus, chunk_size):
+        n_docs += len(chunk)
+        counts, terms = count_terms(chunk, stop_words)
+        if counts is not None:
+            update_term_stats(term_freqs, doc_freqs, counts, terms)
+    return term_freqs, doc_freqs, n_docs
+
+
+def select_vocabulary(term_freqs: dict, vocab_size: int) -> list:
+    """Returns the `vocab_size` most frequent terms, in alphabetical order
+    (as `TfidfVectorizer(max_features=vocab_size)`)."""
+    terms = sorted(term_freqs)
+    tfs = np.array([term_freqs[t] for t in terms])
+    top = np.sort((-tfs).argsort(kind="mergesort")[:vocab_size])
+    return [terms[i] for i in top]
+
+
+def tfidf_compute_chunked(
+    corpus_factory,
+    vocab_size=1000,
+    stop_words: list = None,
+    chunk_size=1000,
+    hashing=False,
+    n_features=2 ** 20,
+):
+    """Out-of-core version of `tfidf_compute`: documents are read from disk
+    and vectorized `chunk_size` at a time, so the corpus is never in memory.
+
+    By default, the corpus is read twice. The first pass counts term and
+    document frequencies to select the `vocab_size` most frequent words,
+    as `TfidfVectorizer(max_features=vocab_size)` does. The second pass
+    builds the tfidf matrix restricted to those words.
+
+    If `hashing` is True, terms are hashed into `n_features` buckets (as in
+    `HashingVectorizer`). The first pass only keeps the term frequency of
+    every bucket, a fixed-size array instead of per-term dicts, so memory
+    does not grow with the corpus vocabulary. The second pass counts the
+    `vocab_size` most frequent buckets only. Each bucket is named after its
+    most frequent term in the corpus; colliding terms are merged into it.
+
+    Args:
+        corpus_factory (callable): returns a new iterable over the corpus
+            documents at each call, e.g. `lambda: iter_texts(txts_dir)`.
+        vocab_size (int, optional): Number of words to extract. Defaults to 1000.
+        stop_words (list, optional): Stop-words list. Defaults to None.
+        chunk_size (int, optional): documents vectorized at once. Defaults to 1000.
+        hashing (bool, optional): hashing mode. Defaults to False.
+        n_features (int, optional): hash buckets, in hashing mode. Defaults to 2**20.
+
+    Returns:
+        (tuple): word_document_matrix, matrix_words
+    """
+    logging.info("Computing chunked TFIDF...")
+    if hashing:
+        return _tfidf_hashing(corpus_factory, vocab_size, stop_words, chunk_size, n_features)
+
+    # first pass: term and document frequencies
+    term_freqs, doc_freqs, _ = corpus_term_stats(corpus_factory(), stop_words, chunk_size)
+    words = select_vocabulary(term_freqs, vocab_size)
+    df = np.array([doc_freqs[w] for w in words])
+    del term_freqs, doc_freqs
+
+    # second pass: counts of the selected words
+    counter = CountVectorizer(stop_words=stop_words, vocabulary=words)
+    chunks = [counter.transform(chunk) for chunk in iter_chunks(corpus_factory(), chunk_size)]
+    count_matrix = vstack(chunks, format="csr")
+    document_term_matrix = tfidf_weight(count_matrix, df, count_matrix.shape[0])
+    return document_term_matrix.transpose(), words
+
+
+def hash_buckets(terms, n_features):
+    return np.array([murmurhash3_32(t, positive=True) % n_features for t in terms])
+
+
+def _tfidf_hashing(corpus_factory, vocab_size, stop_words, chunk_size, n_features):
+    """Hashing mode of `tfidf_compute_chunked`."""
+    # first pass: term frequency of every bucket
+    bucket_tfs = np.zeros(n_features)
+    for chunk in iter_chunks(corpus_factory(), chunk_size):
+        counts, terms = count_terms(chunk, stop_words)
+        if counts is not None:
+            np.add.at(bucket_tfs, hash_buckets(terms, n_features), np.asarray(counts.sum(axis=0)).ravel())
+    top = (-bucket_tfs).argsort(kind="mergesort")[:vocab_size]
+    top = top[bucket_tfs[top] > 0]
+    del bucket_tfs
+    # bucket -> column, -1 for the buckets not selected
+    bucket_cols = np.full(n_features, -1)
+    bucket_cols[top] = np.arange(len(top))
+
+    # second pass: counts of the selected buckets only, and corpus-wide
+    # frequency of the terms falling in them (to name the buckets)
+    term_freqs = {}
+    chunks = []
+    for chunk in iter_chunks(corpus_factory(), chunk_size):
+        counts, terms = count_terms(chunk, stop_words)
+        if counts is None:
+            chunks.append(csr_matrix((len(chunk), len(top))))
+            continue
+        cols = bucket_cols[hash_buckets(terms, n_features)]
+        kept = np.flatnonzero(cols >= 0)
+        to_cols = csr_matrix(
+            (np.ones(len(kept)), (kept, cols[kept])), shape=(len(terms), len(top))
+        )
+        chunks.append((counts @ to_cols).tocsr())
+        chunk_tfs = np.asarray(counts.sum(axis=0)).ravel()
+        for j in kept:
+            term_freqs[terms[j]] = term_freqs.get(terms[j], 0) + int(chunk_tfs[j])
+
+    # each bucket is named after its most frequent term
+    best_tf = np.zeros(len(top))
+    words = [None] * len(top)
+    all_terms = list(term_freqs)
+    for term, col in zip(all_terms, bucket_cols[hash_buckets(all_terms, n_features)]):
+        if term_freqs[term] > best_tf[col]:
+            best_tf[col] = term_freqs[term]
+            words[col] = term
+
+    count_matrix = vstack(chunks, format="csr")
+    del chunks
+    # columns in alphabetical order of their words, as in `tfidf_compute`
+    order = np.argsort(words, kind="mergesort")
+    words = [words[i] for i in order]
+    count_matrix = count_matrix[:, order]
+    df = np.bincount(count_matrix.indices, minlength=len(top))
+    document_term_matrix = tfidf_weight(count_matrix, df, count_matrix.shape[0])
+    return document_term_matrix.transpose(), words
+
+
 def tfidf_save(tfidf_dir:Path, tfidf_matrix, tfidf_words:list):
     """Save output from `tfidf_compute`.
 
@@ -0,0 +1,163 @@
+from sklearn.feature_extraction.text import CountVectorizer
+from scipy.sparse import save_npz, load_npz, vstack, csr_matrix
+from pathlib import Path
+import numpy as np
+import heapq
+import pickle
+import logging
+
+from LSA.tfidf import (
+    iter_chunks,
+    count_terms,
+    update_term_stats,
+    select_vocabulary,
+    tfidf_weight,
+)
+
+
+class TfidfModel:
+    """Persistent, incrementally updatable TF-IDF model.
+
+    The model keeps the term and document frequencies of every term seen,
+    the vocabulary (the `vocab_size` most frequent terms when it was last
+    built) and the raw counts of the vocabulary words in every document.
+    New documents are added with `ingest`, in time proportional to their
+    number: their counts are appended and the statistics are updated.
+    IDF weights and normalization are applied lazily by `matrix`.
+
+    The vocabulary is only rebuilt when its drift (the fraction of the
+    current top `vocab_size` terms missing from it) exceeds `drift_threshold`,
+    since rebuilding requires counting the new words in the whole corpus.
+
+    Args:
+        vocab_size (int, optional): Number of words to extract. Defaults to 1000.
+        stop_words (list, optional): Stop-words list. Defaults to None.
+        drift_threshold (float, optional): Defaults to 0.1.
+    """
+
+    def __init__(self, vocab_size=1000, stop_words: list = None, drift_threshold=0.1):
+        self.vocab_size = vocab_size
+        self.stop_words = stop_words
+        self.drift_threshold = drift_threshold
+        self.term_freqs = {}
+        self.doc_freqs = {}
+        self.n_docs = 0
+        self.doc_ids = []
+        self.words = []
+        self.count_chunks = []
+        self._tfidf = None
+
+    def fit(self, corpus_factory, doc_ids=None, chunk_size=1000):
+        """Builds the model from scratch.
+
+        Args:
+            corpus_factory (callable): returns a new iterable over the corpus
+                documents at each call, e.g. `lambda: iter_texts(txts_dir)`.
+            doc_ids (list, optional): documents IDs. Defaults to their position.
+            chunk_size (int, optional): documents vectorized at once. Defaults to 1000.
+        """
+        self.term_freqs = {}
+        self.doc_freqs = {}
+        self.n_docs = 0
+        for chunk in iter_chunks(corpus_factory(), chunk_size):
+            self._add_stats(chunk)
+        self.doc_ids = list(doc_ids) if doc_ids is not None else list(range(self.n_docs))
+        self.rebuild(corpus_factory, chunk_size)
+        return self
+
+    def rebuild(self, corpus_factory, chunk_size=1000):
+        """Selects the vocabulary from the current statistics, and recounts
+        it in the whole corpus."""
+        logging.info("Rebuilding TFIDF vocabulary...")
+        self.words = select_vocabulary(self.term_freqs, self.vocab_size)
+        counter = CountVectorizer(stop_words=self.stop_words, vocabulary=self.words)
+        self.count_chunks = [
+            counter.transform(chunk) for chunk in iter_chunks(corpus_factory(), chunk_size)
+        ]
+        self._tfidf = None
+
+    def drift(self) -> float:
+        """Fraction of the current top `vocab_size` terms that are not in the vocabulary."""
+        top = heapq.nlargest(self.vocab_size, self.term_freqs, key=self.term_freqs.get)
+        if not top:
+            return 0.0
+        return 1 - len(set(top).intersection(self.words)) / len(top)
+
+    def ingest(self, texts, doc_ids=None, corpus_factory=None):
+        """Adds new documents to the model.
+
+        If the vocabulary drift exceeds `drift_threshold` and `corpus_factory`
+        (over the whole corpus, new documents included) is given, the
+        vocabulary is rebuilt. Otherwise, a warning is logged.
+
+        Args:
+            texts (list): new documents
+            doc_ids (list, optional): IDs of the new documents.
+            corpus_factory (callable, optional): see `fit`.
+        """
+        texts = list(texts)
+        counts, terms = self._add_stats(texts)
+        if doc_ids is None:
+            doc_ids = range(len(self.doc_ids), len(self.doc_ids) + len(texts))
+        self.doc_ids += list(doc_ids)
+
+        # counts of the vocabulary words, from the counts of all the terms
+        vocab_index = {w: j for j, w in enumerate(self.words)}
+        if counts is None:
+            self.count_chunks.append(csr_matrix((len(texts), len(self.words))))
+        else:
+            cols = np.array([vocab_index.get(t, -1) for t in terms])
+            kept = np.flatnonzero(cols >= 0)
+            to_vocab = csr_matrix(
+                (np.ones(len(kept)), (kept, cols[kept])),
+                shape=(len(terms), len(self.words)),
+            )
+            self.count_chunks.append((counts @ to_vocab).tocsr())
+        self._tfidf = None
+
+        drift = self.drift()
+        if drift > self.drift_threshold:
+            if corpus_factory is not None:
+                self.rebuild(corpus_factory)
+            else:
+                logging.warning(
+                    f"TFIDF vocabulary drift {drift:.2f} exceeds {self.drift_threshold}: "
+                    "call `rebuild` to update the vocabulary."
+                )
+
+    def matrix(self):
+        """Returns the tfidf word-document matrix and its row indexes (words),
+        as `tfidf_compute`. The IDF weights reflect all the ingested documents."""
+        if self._tfidf is None:
+            count_matrix = vstack(self.count_chunks, format="csr")
+            df = np.array([self.doc_freqs[w] for w in self.words])
+            self._tfidf = tfidf_weight(count_matrix, df, self.n_docs).transpose()
+        return self._tfidf, self.words
+
+    def save(self, model_dir: Path):
+        """Saves the model in `model_dir`."""
+        logging.info(f"Saving TFIDF model in \n {model_dir}")
+        model_dir.mkdir(parents=True, exist_ok=True)
+        count_matrix = vstack(self.count_chunks, format="csr")
+        save_npz(model_dir / Path("counts.npz"), count_matrix, compressed=True)
+        state = {k: v for k, v in self.__dict__.items() if k not in ("count_chunks", "_tfidf")}
+        with open(model_dir / Path("model.pkl"), "wb") as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, model_dir: Path):
+        """Loads a model saved with `save`."""
+        print(f"Loading TFIDF model from \n {model_dir}")
+        model = cls()
+        with open(model_dir / Path("model.pkl"), "rb") as f:
+            model.__dict__.update(pickle.load(f))
+        model.count_chunks = [load_npz(model_dir / Path("counts.npz"))]
+        model._tfidf = None
+        return model
+
+    def _add_stats(self, texts):
+        self.n_docs += len(texts)
+        counts, terms = count_terms(texts, self.stop_words)
+        if counts is not None:
+            update_term_stats(self.term_freqs, self.doc_freqs, counts, terms)
+        return counts, terms
@@ -0,0 +1,69 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from utils.utils import period_indicator
+
+
+def top_word_indexes(word_topic_matrix, N=3):
+    """Returns a (topics x N) array with the indexes of the top N words of
+    every topic, in ascending order of weight (the top word is last).
+
+    All topics are processed at once with `argpartition`, so only the
+    N top entries of each topic are sorted.
+    """
+    word_topic_matrix = np.asarray(word_topic_matrix)
+    N = min(N, word_topic_matrix.shape[0])
+    top = np.argpartition(word_topic_matrix, -N, axis=0)[-N:]
+    top_weights = np.take_along_axis(word_topic_matrix, top, axis=0)
+    order = np.argsort(top_weights, axis=0)
+    return np.take_along_axis(top, order, axis=0).T
+
+
+def topic_assignments(topic_doc_matrix):
+    """Assigns each document to the topic with the greatest component
+    in its topic-embedding."""
+    return np.asarray(topic_doc_matrix).argmax(axis=0)
+
+
+def topic_assignment_counts(topic_doc_matrix):
+    """Returns the number of documents assigned to each topic (see `topic_assignments`)."""
+    n_topics = topic_doc_matrix.shape[0]
+    return np.bincount(topic_assignments(topic_doc_matrix), minlength=n_topics)
+
+
+def topic_share_over_time(topic_doc_matrix, periods, mode="argmax"):
+    """Computes the share of each topic in each period.
+
+    With mode "argmax" (default), each document counts for the topic it is
+    assigned to (see `topic_assignments`). With mode "weight", each document
+    is spread over the topics proportionally to the absolute values of its
+    topic-embedding. In both cases the result is a single product of the
+    (topics x documents) weights with the period indicator matrix.
+
+    Args:
+        topic_doc_matrix (matrix): lsa topics as documents-embedding
+        periods (array): period label of each document (column), e.g. the
+            "Year" or "Month" column of the dataframe (see `add_year_column`,
+            `add_month_column`)
+        mode (str, optional): "argmax" or "weight"
+
+    Returns:
+        tuple of (topics x periods) share matrix, sorted period labels
+    """
+    indicator, labels = period_indicator(periods)
+    n_topics, n_docs = topic_doc_matrix.shape
+    if mode == "argmax":
+        weights = csr_matrix(
+            (np.ones(n_docs), (topic_assignments(topic_doc_matrix), np.arange(n_docs))),
+            shape=(n_topics, n_docs),
+        )
+        counts = (weights @ indicator).toarray()
+    elif mode == "weight":
+        weights = np.abs(np.asarray(topic_doc_matrix))
+        weights = weights / np.maximum(weights.sum(axis=0, keepdims=True), 1e-12)
+        counts = np.asarray((indicator.T @ weights.T).T)
+    else:
+        raise ValueError("ERROR: invalid value for mode argument")
+
+    totals = counts.sum(axis=0, keepdims=True)
+    return counts / np.maximum(totals, 1e-12), labels
@@ -0,0 +1,53 @@
+"""Benchmark of `clean_str`, in input tokens per second, comparing
+`word_tokenize` with the fast tokenizer, with and without lemma cache,
+and the mismatch of the fast tokenizer output (see `clean_txt.fast_mismatch`).
+
+Run from the repository root, on a directory of txts (defaults to the
+fixtures of `clean_txt.check_fast_tokenizer`):
+    python -m benchmarks.clean_bench [path/to/txts]
+"""
+import argparse
+import time
+from pathlib import Path
+
+from data_pipeline import clean_txt
+
+
+def run(texts, fast, cache_size):
+    clean_txt.lemma_cache = clean_txt.LemmaCache(cache_size)
+    start = time.perf_counter()
+    outputs = [clean_txt.clean_str(t, fast) for t in texts]
+    return outputs, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark txt cleaning")
+    arg_parser.add_argument(
+        "txt_dir", nargs="?", default=clean_txt.FAST_FIXTURES_DIR, help="dir with txt files"
+    )
+    args = arg_parser.parse_args()
+
+    clean_txt.ensure_nltk_data()
+    clean_txt.init_cleaner()
+    texts = [f.read_text(errors="replace") for f in sorted(Path(args.txt_dir).glob("*.txt"))]
+    n_tokens = sum(len(t.split()) for t in texts)
+    # warm up wordnet, so that its loading time is not measured
+    clean_txt.lemmatizer.lemmatize("warmup")
+    print(f"{len(texts)} docs, {n_tokens} whitespace tokens\n")
+
+    modes = {
+        "word_tokenize": (False, 0),
+        "word_tokenize+cache": (False, 200_000),
+        "fast+cache": (True, 200_000),
+    }
+    outputs = {}
+    print("mode\tseconds\ttokens/s")
+    for mode, (fast, cache_size) in modes.items():
+        outputs[mode], elapsed = run(texts, fast, cache_size)
+        print(f"{mode}\t{elapsed:.2f}\t{n_tokens / elapsed:.0f}")
+
+    reference = outputs["word_tokenize"]
+    for mode in modes:
+        same = sum(a == b for a, b in zip(reference, outputs[mode]))
+        print(f"{mode}: {same}/{len(texts)} docs identical to word_tokenize output")
+    print(f"fast_tokenize: {clean_txt.fast_mismatch(texts):.4%} of output tokens differ from word_tokenize")
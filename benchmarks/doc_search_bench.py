@@ -0,0 +1,50 @@
+"""Queries/s of the similar-patent search (`LSA.doc_search`) as the corpus
+grows: exact blocked search against the approximate IVF index (with its
+recall of the exact top-k).
+
+Random embeddings are saved and memory-mapped as in `save_embeddings`.
+
+Run from the repository root:
+    python -m benchmarks.doc_search_bench --sizes 10000 100000 1000000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from LSA.doc_search import save_embeddings, load_embeddings, top_k, IvfIndex
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark similar-patent search")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    arg_parser.add_argument("--topics", type=int, default=100)
+    arg_parser.add_argument("--queries", type=int, default=1000)
+    arg_parser.add_argument("--k", type=int, default=10)
+    arg_parser.add_argument("--lists", type=int, default=256)
+    arg_parser.add_argument("--probe", type=int, default=8)
+    args = arg_parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("docs\tmethod\tqueries/s\trecall")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_docs in args.sizes:
+            store_dir = Path(tmp) / Path(str(n_docs))
+            embeddings = rng.standard_normal((args.topics, n_docs), dtype=np.float32)
+            save_embeddings(embeddings, range(n_docs), store_dir)
+            embeddings, _ = load_embeddings(store_dir)
+            queries = embeddings[rng.choice(n_docs, args.queries, replace=False)]
+
+            start = time.perf_counter()
+            _, exact = top_k(queries, embeddings, args.k)
+            t_exact = time.perf_counter() - start
+            print(f"{n_docs}\texact\t{args.queries / t_exact:.0f}\t1.00")
+
+            index = IvfIndex(min(args.lists, n_docs), args.probe).fit(embeddings)
+            start = time.perf_counter()
+            _, approx = index.search(queries, embeddings, args.k)
+            t_approx = time.perf_counter() - start
+            recall = np.mean([len(np.intersect1d(a, e)) / args.k for a, e in zip(approx, exact)])
+            print(f"{n_docs}\tivf\t{args.queries / t_approx:.0f}\t{recall:.2f}")
@@ -0,0 +1,79 @@
+"""Benchmark of `download_from_mtdt` against a local HTTP server.
+
+Run from the repository root:
+    python -m benchmarks.download_bench --files 200 --latency 0.05
+"""
+import argparse
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+
+import pandas as pd
+
+from data_pipeline.pdf_download import download_from_mtdt
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    """Static file handler adding a fixed latency to every request."""
+
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def make_fixtures(root: Path, n_files: int, size: int, port: int):
+    """Writes `n_files` fake pdfs in `root/served`, and a metadata csv
+    linking them in `root/metadata`.
+    """
+    served = root / "served"
+    metadata = root / "metadata"
+    served.mkdir()
+    metadata.mkdir()
+    payload = b"%PDF-1.4\n" + b"0" * size
+    for i in range(n_files):
+        (served / f"{i}.pdf").write_bytes(payload)
+    df = pd.DataFrame(
+        {
+            "Link": [f"http://127.0.0.1:{port}/{i}.pdf" for i in range(n_files)],
+            "Date_Priority": ["2020-01-01"] * n_files,
+        }
+    )
+    df.to_csv(metadata / "2020_patents.csv", index=False)
+    return served, metadata
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the pdf downloader")
+    arg_parser.add_argument("--files", type=int, default=200)
+    arg_parser.add_argument("--size", type=int, default=500_000, help="bytes per file")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        SlowHandler.latency = args.latency
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(SlowHandler, directory=str(root / "served")))
+        port = server.server_address[1]
+        _, metadata_dir = make_fixtures(root, args.files, args.size, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        results = {}
+        for workers in args.workers:
+            pdf_dir = root / f"pdf_{workers}"
+            start = time.perf_counter()
+            download_from_mtdt(metadata_dir, pdf_dir, overwrite=True, workers=workers)
+            results[workers] = time.perf_counter() - start
+        server.shutdown()
+
+    print("\nworkers\tseconds\tfiles/s")
+    for workers, elapsed in results.items():
+        print(f"{workers}\t{elapsed:.2f}\t{args.files / elapsed:.1f}")
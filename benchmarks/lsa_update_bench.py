@@ -0,0 +1,47 @@
+"""Cost of adding documents to an LSA model: fold-in (`LsaModel.transform`)
+and incremental update (`LsaModel.update`) against a full recompute.
+
+A random sparse word-document matrix is factorized, then a batch of new
+documents is added in each of the three ways.
+
+Run from the repository root:
+    python -m benchmarks.lsa_update_bench --docs 60000 --new 5000
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import random as sparse_random, hstack
+
+from LSA.lsa_model import LsaModel
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark LSA fold-in and updates")
+    arg_parser.add_argument("--words", type=int, default=1000)
+    arg_parser.add_argument("--docs", type=int, default=60000)
+    arg_parser.add_argument("--new", type=int, default=5000)
+    arg_parser.add_argument("--topics", type=int, default=20)
+    arg_parser.add_argument("--density", type=float, default=0.05)
+    args = arg_parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    matrix = sparse_random(args.words, args.docs, args.density, format="csc", random_state=rng)
+    new = sparse_random(args.words, args.new, args.density, format="csc", random_state=rng)
+    full = hstack([matrix, new], format="csc")
+
+    print("method\toperation\tseconds")
+    for method in ["SVD", "NMF"]:
+        model, _ = timed(LsaModel(args.topics, method).fit, matrix)
+        _, t_full = timed(LsaModel(args.topics, method).fit, full)
+        _, t_fold = timed(model.transform, new)
+        _, t_update = timed(model.update, new)
+        print(f"{method}\tfull recompute\t{t_full:.2f}")
+        print(f"{method}\tfold-in\t{t_fold:.2f}")
+        print(f"{method}\tupdate\t{t_update:.2f}")
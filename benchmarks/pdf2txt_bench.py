@@ -0,0 +1,39 @@
+"""Benchmark of the pdf text-extraction backends, in pages per second.
+
+Run from the repository root, on a directory of fixture pdfs:
+    python -m benchmarks.pdf2txt_bench path/to/pdfs --backends tika pdfminer
+"""
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from functools import partial
+from pathlib import Path
+
+from data_pipeline.pdf2txt import BACKENDS, extract_text
+
+
+def count_pages(pdf: Path, backend: str):
+    try:
+        _, n_pages = extract_text(pdf, backend)
+    except Exception:
+        return 0
+    return n_pages
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark pdf extraction backends")
+    arg_parser.add_argument("pdf_dir", help="dir with fixture pdf files")
+    arg_parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    arg_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = arg_parser.parse_args()
+
+    pdfs = sorted(Path(args.pdf_dir).glob("**/*.pdf"))
+    print(f"{len(pdfs)} pdfs, {args.processes} processes\n")
+    print("backend\tpages\tseconds\tpages/s")
+    for backend in args.backends:
+        start = time.perf_counter()
+        with Pool(args.processes) as pool:
+            pages = sum(pool.imap_unordered(partial(count_pages, backend=backend), pdfs))
+        elapsed = time.perf_counter() - start
+        print(f"{backend}\t{pages}\t{elapsed:.2f}\t{pages / elapsed:.1f}")
@@ -0,0 +1,38 @@
+"""Timing of the vectorized topic analytics on a random topic-document matrix.
+
+Run from the repository root:
+    python -m benchmarks.topic_analytics_bench --docs 60000 --topics 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from LSA.topic_analytics import top_word_indexes, topic_assignment_counts, topic_share_over_time
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark topic analytics")
+    arg_parser.add_argument("--words", type=int, default=1000)
+    arg_parser.add_argument("--docs", type=int, default=60000)
+    arg_parser.add_argument("--topics", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    word_topic_matrix = rng.rand(args.words, args.topics)
+    topic_doc_matrix = rng.rand(args.topics, args.docs)
+    years = rng.randint(2000, 2020, args.docs)
+    months = np.array([f"{y}-{m:02d}" for y, m in zip(years, rng.randint(1, 13, args.docs))])
+
+    runs = {
+        "top 10 words": lambda: top_word_indexes(word_topic_matrix, 10),
+        "assignment counts": lambda: topic_assignment_counts(topic_doc_matrix),
+        "share by year (argmax)": lambda: topic_share_over_time(topic_doc_matrix, years),
+        "share by year (weight)": lambda: topic_share_over_time(topic_doc_matrix, years, "weight"),
+        "share by month (argmax)": lambda: topic_share_over_time(topic_doc_matrix, months),
+    }
+    print("operation\tms")
+    for name, run in runs.items():
+        start = time.perf_counter()
+        run()
+        print(f"{name}\t{1000 * (time.perf_counter() - start):.1f}")
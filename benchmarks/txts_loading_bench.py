@@ -0,0 +1,67 @@
+"""Peak RSS and wall time of the corpus loading modes of `utils.txts_loading`:
+
+- serial: `df_from_txts` (default, serial reads)
+- threaded: `df_from_txts` with a pool of 8 threads
+- lazy: `iter_txts`, consuming one text at a time
+
+With `--tfidf`, the loaded corpus is also fed to `tfidf_compute`, and the
+out-of-core `tfidf_compute_chunked` (two-pass and hashing) is measured too.
+Every mode runs in a fresh process, so peak RSS values are comparable.
+
+Run from the repository root:
+    python -m benchmarks.txts_loading_bench path/to/cleaned_txts --tfidf
+"""
+import argparse
+import resource
+import time
+from multiprocessing import get_context
+from pathlib import Path
+
+from utils.txts_loading import df_from_txts, iter_texts
+
+
+def run_mode(mode, txts_dir, tfidf, result_queue):
+    start = time.perf_counter()
+    if mode.startswith("chunked"):
+        from LSA.tfidf import tfidf_compute_chunked
+
+        tfidf_compute_chunked(lambda: iter_texts(txts_dir), hashing=mode == "chunked-hashing")
+        corpus = None
+        tfidf = False
+    elif mode == "serial":
+        corpus = df_from_txts(txts_dir)["Text"]
+    elif mode == "threaded":
+        corpus = df_from_txts(txts_dir, threads=8)["Text"]
+    else:
+        corpus = iter_texts(txts_dir)
+    if tfidf:
+        from LSA.tfidf import tfidf_compute
+
+        tfidf_compute(corpus)
+    elif mode == "lazy":
+        for _ in corpus:
+            pass
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result_queue.put((elapsed, peak_rss))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark corpus loading")
+    arg_parser.add_argument("txts_dir", help="dir with txt files")
+    arg_parser.add_argument("--tfidf", help="also compute tfidf", action="store_true")
+    args = arg_parser.parse_args()
+
+    ctx = get_context("spawn")
+    print("mode\tseconds\tpeak RSS (MiB)")
+    modes = ["serial", "threaded", "lazy"]
+    if args.tfidf:
+        modes += ["chunked", "chunked-hashing"]
+    for mode in modes:
+        result_queue = ctx.Queue()
+        p = ctx.Process(target=run_mode, args=(mode, Path(args.txts_dir), args.tfidf, result_queue))
+        p.start()
+        elapsed, peak_rss = result_queue.get()
+        p.join()
+        print(f"{mode}\t{elapsed:.2f}\t{peak_rss:.0f}")
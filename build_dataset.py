@@ -7,11 +7,19 @@ from data_pipeline.scraper import make_driver, scrape_metadata
 from data_pipeline.pdf_download import download_from_mtdt
 from data_pipeline.pdf2txt import batch_convert
 from data_pipeline.clean_txt import batch_clean
+from data_pipeline.stages import Stage
+from data_pipeline.streaming import stream_pipeline
+from data_pipeline import pdf2txt, clean_txt
 from utils.utils import merge_csv_files
+from utils.corpus_store import corpus_append_txts
+from utils.inverted_index import InvertedIndex
 
 from conf import DRIVER_PATH, METADATA_DIR, YEARS, ASSIGNEE, LANG
 from conf import MAX_PDFS_PER_YEAR, PAGES_PER_YEAR, RESULTS_PER_PAGE
-from conf import PDF_DIR, TXT_DIR, CLEAN_TXT_DIR, METADATA_CSV
+from conf import DOWNLOAD_WORKERS, DOWNLOAD_RATE_LIMIT, PDF_BACKEND
+from conf import OCR_FALLBACK, OCR_CACHE_DIR, FAST_TOKENIZER, LEMMA_CACHE_FILE
+from conf import PDF_DIR, TXT_DIR, CLEAN_TXT_DIR, METADATA_CSV, STAGES_DIR
+from conf import STREAM_QUEUE_SIZE, STREAM_KEEP_INTERMEDIATE, CORPUS_DB, INDEX_DIR
 
 
 arg_parser = argparse.ArgumentParser(
@@ -26,10 +34,23 @@ arg_parser.add_argument("--merge", help="merge the scraped metadata", action="st
 arg_parser.add_argument("--download", help="download pdfs using metadata", action="store_true")
 arg_parser.add_argument("--convert", help="convert pdfs to txts", action="store_true")
 arg_parser.add_argument("--clean", help="clean txts", action="store_true")
+arg_parser.add_argument(
+    "--stream",
+    help="download, convert and clean each document in one streaming pipeline",
+    action="store_true",
+)
+arg_parser.add_argument(
+    "--store", help="store all the cleaned txts in the corpus store", action="store_true"
+)
+arg_parser.add_argument(
+    "--index", help="index the new or modified cleaned txts", action="store_true"
+)
 
 # modes
 arg_parser.add_argument(
-    "--overwrite", help="overwrite existing files", action="store_true"
+    "--overwrite",
+    help="recompute all files (by default, only files whose input, code or config changed)",
+    action="store_true",
 )
 arg_parser.add_argument("--multiproc", help="use multiprocessing", action="store_true")
 
@@ -42,8 +63,9 @@ if args.verbose:
     logging.basicConfig(level=logging.INFO)
 
 if args.delete:
-    dirs = [METADATA_DIR, PDF_DIR, TXT_DIR, CLEAN_TXT_DIR]
+    dirs = [METADATA_DIR, PDF_DIR, TXT_DIR, CLEAN_TXT_DIR, STAGES_DIR, INDEX_DIR]
     [rmtree(d,ignore_errors=True) for d in dirs]
+    CORPUS_DB.unlink(missing_ok=True)
 
 if args.all or args.scrape:
     METADATA_DIR.mkdir(parents=True,exist_ok=True)
@@ -55,12 +77,75 @@ if args.all or args.scrape:
 if args.all or args.merge:
     merge_csv_files(METADATA_DIR, METADATA_CSV)
 
-if args.all or args.download:
-    download_from_mtdt(METADATA_DIR, PDF_DIR, args.overwrite, MAX_PDFS_PER_YEAR)
-
-if args.all or args.convert:
-    batch_convert(PDF_DIR, TXT_DIR, args.overwrite, args.multiproc)
-
-if args.all or args.clean:
-    batch_clean(TXT_DIR, CLEAN_TXT_DIR, args.overwrite, args.multiproc)
-
+if args.stream:
+    if OCR_FALLBACK:
+        logging.warning("OCR fallback is not supported in stream mode: scanned pdfs are skipped")
+    stream_pipeline(
+        METADATA_DIR,
+        CLEAN_TXT_DIR,
+        pdf_dir=PDF_DIR if STREAM_KEEP_INTERMEDIATE else None,
+        txt_dir=TXT_DIR if STREAM_KEEP_INTERMEDIATE else None,
+        overwrite=args.overwrite,
+        max_per_year=MAX_PDFS_PER_YEAR,
+        download_workers=DOWNLOAD_WORKERS,
+        rate_limit=DOWNLOAD_RATE_LIMIT,
+        queue_size=STREAM_QUEUE_SIZE,
+        backend=PDF_BACKEND,
+        fast=FAST_TOKENIZER,
+        lemma_cache_file=LEMMA_CACHE_FILE,
+        corpus_db=CORPUS_DB,
+    )
+    InvertedIndex(INDEX_DIR).update(CLEAN_TXT_DIR.glob("*.txt"), METADATA_DIR)
+
+if (args.all and not args.stream) or args.download:
+    download_from_mtdt(
+        METADATA_DIR,
+        PDF_DIR,
+        args.overwrite,
+        MAX_PDFS_PER_YEAR,
+        workers=DOWNLOAD_WORKERS,
+        rate_limit=DOWNLOAD_RATE_LIMIT,
+    )
+
+if (args.all and not args.stream) or args.convert:
+    convert_config = {"backend": PDF_BACKEND, "ocr": OCR_FALLBACK}
+    convert_stage = Stage("convert", STAGES_DIR, pdf2txt, convert_config)
+    jobs = [(f, TXT_DIR / Path(f.stem + ".txt")) for f in PDF_DIR.glob("**/*.pdf")]
+    stale = convert_stage.plan(jobs, args.overwrite)
+    results = batch_convert(
+        PDF_DIR,
+        TXT_DIR,
+        True,
+        args.multiproc,
+        backend=PDF_BACKEND,
+        ocr=OCR_FALLBACK,
+        ocr_cache_dir=OCR_CACHE_DIR,
+        files=[src for src, _ in stale],
+    )
+    convert_stage.record([job for job in stale if results[job[0]]])
+    print(convert_stage.summary())
+
+if (args.all and not args.stream) or args.clean:
+    clean_stage = Stage("clean", STAGES_DIR, clean_txt, {"fast": FAST_TOKENIZER})
+    jobs = [(f, CLEAN_TXT_DIR / Path(f.name)) for f in TXT_DIR.glob("*.txt")]
+    stale = clean_stage.plan(jobs, args.overwrite)
+    results = batch_clean(
+        TXT_DIR,
+        CLEAN_TXT_DIR,
+        True,
+        args.multiproc,
+        fast=FAST_TOKENIZER,
+        lemma_cache_file=LEMMA_CACHE_FILE,
+        files=[src for src, _ in stale],
+    )
+    cleaned = [job for job in stale if results[job[0]]]
+    clean_stage.record(cleaned)
+    print(clean_stage.summary())
+    corpus_append_txts(CORPUS_DB, [dest for _, dest in cleaned], TXT_DIR, METADATA_DIR)
+    InvertedIndex(INDEX_DIR).update([dest for _, dest in cleaned], METADATA_DIR)
+
+if args.store:
+    corpus_append_txts(CORPUS_DB, CLEAN_TXT_DIR.glob("*.txt"), TXT_DIR, METADATA_DIR)
+
+if args.index:
+    InvertedIndex(INDEX_DIR).update(CLEAN_TXT_DIR.glob("*.txt"), METADATA_DIR)
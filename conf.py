@@ -8,6 +8,12 @@ TXT_DIR         = BASE_DIR / Path('patents_txts')
 CLEAN_TXT_DIR   = BASE_DIR / Path('cleaned_txt')
 METADATA_CSV    = METADATA_DIR / Path('metadata.csv')
 CACHE_DIR       = BASE_DIR / Path('cache')
+# corpus store (ID, year, month, raw and cleaned text), see utils.corpus_store
+CORPUS_DB       = BASE_DIR / Path('corpus.sqlite')
+# inverted index of the cleaned txts, see utils.inverted_index
+INDEX_DIR       = BASE_DIR / Path('index')
+# fingerprint ledgers of the pipeline stages
+STAGES_DIR      = BASE_DIR / Path('stages')
 
 # Read the README to see where to download the chrome driver
 DRIVER_PATH     = BASE_DIR / Path('chromedriver')
@@ -21,4 +27,25 @@ RESULTS_PER_PAGE = 30
 
 # DOWNLOADER
 MAX_PDFS_PER_YEAR = 300
+DOWNLOAD_WORKERS = 8
+# max requests per second to each host (None: no limit)
+DOWNLOAD_RATE_LIMIT = 10
 
+
+# CONVERTER
+# text-extraction backend: "tika" or "pdfminer" (in-process)
+PDF_BACKEND = "tika"
+# OCR pdfs without text layer (requires tesseract and poppler)
+OCR_FALLBACK = False
+OCR_CACHE_DIR = CACHE_DIR / Path('ocr')
+
+# CLEANER
+# regex tokenizer instead of nltk's word_tokenize (see clean_txt.fast_tokenize)
+FAST_TOKENIZER = False
+LEMMA_CACHE_FILE = CACHE_DIR / Path('lemma_cache.json')
+
+# STREAMING PIPELINE (build_dataset.py --stream)
+# max documents waiting between two stages
+STREAM_QUEUE_SIZE = 64
+# keep the pdfs and uncleaned txts of the streamed documents
+STREAM_KEEP_INTERMEDIATE = False
@@ -1,23 +1,79 @@
-from tika import parser
 import re
+import os
 from pathlib import Path
 import logging
 from multiprocessing import Pool
 from functools import partial
 
+from data_pipeline.pdf_download import file_sha256
+
 
 # 2 or more consecutive \s
 spaces_regex = re.compile(r"\s{2,}")
+# pages with fewer characters are considered without text layer
+MIN_PAGE_CHARS = 20
+
 
+def tika_extract(orig: Path):
+    """Extracts the text of a pdf through a Tika server.
 
-def pdf_to_txt(orig: Path, dest: Path = None, overwrite=True):
+    Returns:
+        tuple: text (None if the pdf has no text layer), number of pages
+    """
+    from tika import parser
+
+    raw = parser.from_file(orig.as_posix())
+    txt = raw["content"]
+    n_pages = int((raw.get("metadata") or {}).get("xmpTPg:NPages", 0))
+    return txt, n_pages
+
+
+def pdfminer_extract(orig: Path):
+    """Extracts the text of a pdf in-process, using `pdfminer.six`.
+
+    Returns:
+        tuple: text (None if the pdf has no text layer), number of pages
+    """
+    from pdfminer.high_level import extract_text
+
+    txt = extract_text(orig.as_posix())
+    # pages are separated by form feeds
+    n_pages = txt.count("\f")
+    if not txt.strip():
+        txt = None
+    return txt, n_pages
+
+
+# text-extraction backends, selectable by name
+BACKENDS = {
+    "tika": tika_extract,
+    "pdfminer": pdfminer_extract,
+}
+
+
+def extract_text(orig: Path, backend="tika"):
+    """Extracts the text of a pdf with the `backend` extraction function
+    (see `BACKENDS`).
+
+    Returns:
+        tuple: text (None if the pdf has no text layer), number of pages
+    """
+    try:
+        extract_func = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"ERROR: invalid value for backend argument: {backend}")
+    return extract_func(orig)
+
+
+def pdf_to_txt(orig: Path, dest: Path = None, overwrite=True, backend="tika"):
     """
     Converts a pdf file to txt.
     Args:
         orig (Path): path of pdf file
         dest (Path): directory where output txt is saved
         overwrite (bool): overwrite txt file (if present). Defaults to True.
-    
+        backend (str): text-extraction backend (see `BACKENDS`). Defaults to "tika".
+
     Returns False, if it could not convert successfully the pdf.
     """
     logging.info(f"Converting file {orig}")
@@ -28,18 +84,20 @@ def pdf_to_txt(orig: Path, dest: Path = None, overwrite=True):
     if not overwrite and dest_file.exists():
         return True
 
-    raw = parser.from_file(orig.as_posix())
+    if backend not in BACKENDS:
+        raise ValueError(f"ERROR: invalid value for backend argument: {backend}")
+
     try:
-        txt = raw["content"]
+        txt, _ = extract_text(orig, backend)
     except Exception:
         logging.warning(f" Could not convert: {orig}")
         return False
-    
+
     # this happens if the pdf is a scan
     if txt is None:
         logging.info(f" Did not save output text for {orig} (no OCR output)")
         return False
-    
+
     # compact spaces
     txt = spaces_regex.sub(" ", txt)
     # len too small: probably not flawed OCR output
@@ -52,14 +110,134 @@ def pdf_to_txt(orig: Path, dest: Path = None, overwrite=True):
     return True
 
 
-def batch_convert(orig_dir:Path, dest_dir:Path=None, overwrite=True, multiproc=False):
+def page_texts(orig: Path):
+    """Returns the text layer of every page of a pdf, as a list of strings
+    (empty for pages without text layer, e.g. scanned pages).
     """
-    Converts in txts the pdfs files contained in the `orig_dir` directory (and sub-directories) 
+    try:
+        from pdfminer.high_level import extract_text
+
+        # pages are terminated by form feeds
+        return extract_text(orig.as_posix()).split("\f")[:-1]
+    except Exception:
+        from pdf2image import pdfinfo_from_path
+
+        return [""] * pdfinfo_from_path(orig.as_posix())["Pages"]
+
+
+def ocr_page(task):
+    """OCRs a single pdf page, using the cached output if present.
+
+    Args:
+        task (tuple): pdf path, page number (1-based), cache key,
+            cache dir (or None), dpi, tesseract language
+
+    Returns:
+        str: page text
+    """
+    orig, page, key, cache_dir, dpi, lang = task
+    if cache_dir is not None:
+        cache_file = cache_dir / Path(key + ".txt")
+        if cache_file.exists():
+            return cache_file.read_text(errors="replace")
+
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    image = convert_from_path(orig.as_posix(), dpi=dpi, first_page=page, last_page=page)[0]
+    txt = pytesseract.image_to_string(image, lang=lang)
+
+    if cache_dir is not None:
+        tmp_file = cache_file.with_name(cache_file.name + f".{os.getpid()}")
+        tmp_file.write_text(txt, errors="replace")
+        os.replace(tmp_file, cache_file)
+    return txt
+
+
+def ocr_to_txt(orig: Path, dest: Path, pool, cache_dir: Path = None, dpi=300, lang="eng"):
+    """Converts a (partly) scanned pdf file to txt, using OCR.
+
+    Only the pages without a text layer are OCRed. They are distributed
+    on the processes of `pool`, and their texts are collected in page order.
+    OCR output is cached per page, keyed on the pdf checksum and page
+    number, so pages are never OCRed twice.
+
+    Args:
+        orig (Path): path of pdf file
+        dest (Path): directory where output txt is saved
+        pool (multiprocessing.Pool): pool used for OCR
+        cache_dir (Path, optional): OCR cache directory. Defaults to None (no cache).
+        dpi (int, optional): resolution of the rendered pages. Defaults to 300.
+        lang (str, optional): tesseract language. Defaults to "eng".
+
+    Returns False, if it could not convert successfully the pdf.
+    """
+    logging.info(f"OCR of file {orig}")
+    dest_file = dest / Path(orig.stem + ".txt")
+    if cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        texts = page_texts(orig)
+        doc_hash = file_sha256(orig)
+        tasks = [
+            (orig, i + 1, f"{doc_hash}_{i + 1}_{dpi}_{lang}", cache_dir, dpi, lang)
+            for i, txt in enumerate(texts)
+            if len(txt.strip()) < MIN_PAGE_CHARS
+        ]
+        for task, txt in zip(tasks, pool.imap(ocr_page, tasks)):
+            texts[task[1] - 1] = txt
+    except Exception:
+        logging.warning(f" Could not OCR: {orig}")
+        return False
+
+    txt = spaces_regex.sub(" ", " ".join(texts))
+    if not txt.strip():
+        logging.info(f" Did not save output text for {orig} (no OCR output)")
+        return False
+
+    with open(dest_file, "w", errors="replace") as text_file:
+        text_file.write(txt)
+    logging.info(f" OCRed {len(tasks)}/{len(texts)} pages of {orig}")
+    return True
+
+
+def convert_task(orig: Path, **kwargs):
+    """Calls `pdf_to_txt`, returning the pdf path along with the result."""
+    return orig, pdf_to_txt(orig, **kwargs)
+
+
+def batch_convert(
+    orig_dir: Path,
+    dest_dir: Path = None,
+    overwrite=True,
+    multiproc=False,
+    backend="tika",
+    processes=None,
+    chunksize=None,
+    ocr=False,
+    ocr_cache_dir: Path = None,
+    files: list = None,
+):
+    """
+    Converts in txts the pdfs files contained in the `orig_dir` directory (and sub-directories)
     Args:
         orig_dir (Path): directory to search for pdfs
         dest_dir (Path): directory where to save txts. By default, equals to `orig_dir`.
         overwrite (bool): if overrite=True (default), overwrites existing pdfs in `dest_dir`
         multiproc (bool): enable multiprocessing. Default is False.
+        backend (str): text-extraction backend (see `BACKENDS`). Defaults to "tika".
+        processes (int): number of worker processes. Defaults to the number of cpus.
+        chunksize (int): pdfs sent to a worker at once. By default, it is
+            kept small enough that a huge pdf cannot stall a large batch.
+        ocr (bool): if True, pdfs without text layer are converted with
+            `ocr_to_txt`, distributing their pages on a process pool.
+        ocr_cache_dir (Path): directory for the OCR cache. Defaults to None (no cache).
+        files (list): if set, only these pdfs are converted, instead of
+            every pdf in `orig_dir`.
+
+    Returns:
+        dict: for every pdf, whether it was converted successfully.
     """
     if orig_dir.is_dir() is False:
         raise Exception(f"{orig_dir} is not an existing dir")
@@ -68,19 +246,28 @@ def batch_convert(orig_dir:Path, dest_dir:Path=None, overwrite=True, multiproc=F
 
     logging.info(f" Batch converting - root folder: {orig_dir}")
     dest_dir.mkdir(parents=True, exist_ok=True)
-    present_files = orig_dir.glob("**/*.pdf")
-    present_files = list(present_files)
+    present_files = orig_dir.glob("**/*.pdf") if files is None else files
+    # largest pdfs first, so they do not end up as the stragglers of the run
+    present_files = sorted(present_files, key=lambda f: f.stat().st_size, reverse=True)
 
+    processes = processes or os.cpu_count()
     if multiproc:
-        convert_func = partial(pdf_to_txt, dest=dest_dir, overwrite=overwrite)
-        pool = Pool(processes=4)
-        results = pool.map(convert_func, present_files)
-        pool.close()
-        pool.join()
+        if chunksize is None:
+            chunksize = max(1, min(8, len(present_files) // (processes * 16)))
+        convert_func = partial(convert_task, dest=dest_dir, overwrite=overwrite, backend=backend)
+        with Pool(processes=processes) as pool:
+            results = dict(pool.imap_unordered(convert_func, present_files, chunksize))
     else:
-        results = []
+        results = {}
         for f in present_files:
-            r = pdf_to_txt(f, dest_dir, overwrite)
-            results.append(r)
+            results[f] = pdf_to_txt(f, dest_dir, overwrite, backend)
+
+    if ocr:
+        scanned = [f for f, r in results.items() if not r]
+        logging.info(f" OCR fallback for {len(scanned)} pdfs")
+        with Pool(processes=processes if multiproc else 1) as pool:
+            for f in scanned:
+                results[f] = ocr_to_txt(f, dest_dir, pool, ocr_cache_dir)
 
-    logging.info(f" Number of successful convertions: {sum(results)}")
\ No newline at end of file
+    logging.info(f" Number of successful convertions: {sum(results.values())}")
+    return results
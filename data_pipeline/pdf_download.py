@@ -3,17 +3,254 @@ import glob
 import pandas as pd
 import progressbar
 import time
+import os
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from pathlib import Path
 import argparse
 
-def download_from_mtdt(metadata_dir:Path, pdf_dir:Path, overwrite=True, max_per_year=1e4):
+# bytes read from the socket per write
+CHUNK_SIZE = 1 << 16
+# status codes worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# per-year manifest, saved next to the pdfs
+MANIFEST_NAME = "manifest.json"
+# completed downloads between two manifest saves
+MANIFEST_SAVE_EVERY = 50
+
+
+class HostRateLimiter:
+    """Limits the number of requests per second sent to each host.
+
+    Every thread calls `wait(url)` before a request: the call blocks until
+    at least `1 / rate` seconds have passed since the previous request
+    to the same host. A `rate` of 0 or None disables the limit.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def make_session(workers: int = 8):
+    """Returns a `requests.Session` whose connection pool can keep
+    a keep-alive connection open for each of the `workers` threads.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_sha256(filepath: Path) -> str:
+    """Returns the hex SHA-256 digest of `filepath`."""
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f_stream:
+        for chunk in iter(lambda: f_stream.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_manifest(save_dir: Path) -> dict:
+    """Loads the download manifest of `save_dir`.
+
+    The manifest maps each pdf filename to a record with the keys
+    "url", "size", "sha256", "etag", "last_modified" and "status".
+    Returns an empty dict if no manifest is present.
+    """
+    manifest_file = save_dir / Path(MANIFEST_NAME)
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file) as f_stream:
+        return json.load(f_stream)
+
+
+def save_manifest(save_dir: Path, manifest: dict):
+    """Atomically writes the download manifest of `save_dir`."""
+    manifest_file = save_dir / Path(MANIFEST_NAME)
+    tmp_file = manifest_file.with_name(MANIFEST_NAME + ".part")
+    with open(tmp_file, "w") as f_stream:
+        json.dump(manifest, f_stream, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def is_intact(filepath: Path, entry: dict) -> bool:
+    """Checks `filepath` against its manifest `entry`.
+    A file is intact if its size and SHA-256 match the recorded ones.
+    """
+    if not entry or entry.get("sha256") is None or not filepath.exists():
+        return False
+    if filepath.stat().st_size != entry["size"]:
+        return False
+    return file_sha256(filepath) == entry["sha256"]
+
+
+def download_file(
+    url: str,
+    filepath: Path,
+    session,
+    rate_limiter=None,
+    retries=3,
+    backoff=1.0,
+    entry: dict = None,
+):
+    """Downloads `url` to `filepath`.
+
+    The response is streamed in chunks to a temporary `.part` file,
+    which is renamed to `filepath` only once the download is complete,
+    so an interrupted run never leaves a truncated pdf behind.
+    Failed requests (connection errors, truncated responses and status codes
+    in `RETRY_STATUS`) are retried `retries` times, waiting
+    `backoff * 2**attempt` seconds between attempts. Other error status
+    codes fail immediately.
+
+    If a manifest `entry` is given, the request is conditional on its
+    ETag / Last-Modified values, and a "304 Not Modified" response
+    keeps the current file.
+
+    Args:
+        url (str): url of the file
+        filepath (Path): destination path
+        session (requests.Session): session used for the request
+        rate_limiter (HostRateLimiter, optional): per-host rate limit.
+        retries (int, optional): number of retries. Defaults to 3.
+        backoff (float, optional): base backoff time in seconds. Defaults to 1.
+        entry (dict, optional): manifest record of the current file.
+
+    Returns:
+        dict: manifest record of the file. Its "status" is "downloaded",
+        "not_modified" or "failed".
+    """
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    tmp_path = filepath.with_name(filepath.name + ".part")
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=30) as download:
+                if download.status_code in RETRY_STATUS:
+                    logging.info(f"{url}: status {download.status_code}, retrying")
+                    continue
+                if download.status_code == 304 and entry is not None:
+                    return dict(entry, status="not_modified")
+                if download.status_code >= 400:
+                    # permanent error (e.g. 403, 404): retrying would not help
+                    logging.info(f"{url}: status {download.status_code}")
+                    break
+                sha = hashlib.sha256()
+                size = 0
+                with open(tmp_path, "wb") as f_stream:
+                    for chunk in download.iter_content(CHUNK_SIZE):
+                        f_stream.write(chunk)
+                        sha.update(chunk)
+                        size += len(chunk)
+                expected = download.headers.get("Content-Length")
+                if expected is not None and "Content-Encoding" not in download.headers:
+                    if int(expected) != size:
+                        logging.info(f"{url}: truncated response, retrying")
+                        continue
+            os.replace(tmp_path, filepath)
+            return {
+                "url": url,
+                "size": size,
+                "sha256": sha.hexdigest(),
+                "etag": download.headers.get("ETag"),
+                "last_modified": download.headers.get("Last-Modified"),
+                "status": "downloaded",
+            }
+        except requests.RequestException as e:
+            logging.info(f"{url}: {e}, retrying")
+
+    tmp_path.unlink(missing_ok=True)
+    logging.warning(f"Could not download {url}")
+    failed = dict(entry) if entry is not None else {"url": url, "size": None, "sha256": None}
+    failed["status"] = "failed"
+    return failed
+
+
+def sync_file(
+    url: str, filepath: Path, session, rate_limiter, entry: dict, overwrite, revalidate
+):
+    """Brings `filepath` up to date with `url`, using its manifest `entry`.
+
+    Intact files (see `is_intact`) are skipped, or revalidated with a
+    conditional request if `revalidate` is True. Missing, partial or
+    corrupt files, and files whose url changed, are downloaded again.
+
+    Returns:
+        dict: the updated manifest record.
+    """
+    if entry is not None and entry.get("url") != url:
+        entry = None
+    if overwrite or not is_intact(filepath, entry):
+        if not overwrite and filepath.exists():
+            logging.info(f"{filepath.name} is partial or corrupt, downloading again")
+        record = download_file(url, filepath, session, rate_limiter)
+        # a failed download leaves the current file in place: keep its record
+        if record["status"] == "failed" and entry is not None:
+            return dict(entry, status="failed")
+        return record
+    if not revalidate:
+        return dict(entry, status="skipped")
+    return download_file(url, filepath, session, rate_limiter, entry=entry)
+
+
+def download_from_mtdt(
+    metadata_dir: Path,
+    pdf_dir: Path,
+    overwrite=True,
+    max_per_year=1e4,
+    workers=8,
+    rate_limit=None,
+    revalidate=True,
+):
     """Downloads the pdfs linked in the metadata files.
 
+    Downloads run concurrently on `workers` threads sharing one
+    keep-alive session.
+    Every year directory holds a manifest (see `load_manifest`) recording
+    url, size, checksum and HTTP validators of each pdf, so that re-runs
+    only fetch the files that are missing, corrupt or changed upstream.
+    The manifest is saved every `MANIFEST_SAVE_EVERY` completed downloads.
+
     Args:
         metadata_dir (Path): dir containing metadata files
         pdf_dir (Path): dir containing pdf files
-        overwrite (bool, optional): Whether to overwrite existing pdfs.
-            Defaults to True.
+        overwrite (bool, optional): Whether to re-download every pdf,
+            ignoring the manifest. Defaults to True.
+        max_per_year (int, optional): max number of pdfs per metadata file.
+        workers (int, optional): number of download threads. Defaults to 8.
+        rate_limit (float, optional): max requests per second to each host.
+            Defaults to None (no limit).
+        revalidate (bool, optional): If True (default), intact pdfs are
+            revalidated with conditional requests. Otherwise they are skipped.
     """
     mtdt_files = metadata_dir.glob('*.csv')
     mtdt_files = list(mtdt_files)
@@ -22,8 +259,10 @@ def download_from_mtdt(metadata_dir:Path, pdf_dir:Path, overwrite=True, max_per_
         print(f'\t {file}')
 
     print(f'\n Overwrite existing pdfs: {overwrite} \n')
+    session = make_session(workers)
+    rate_limiter = HostRateLimiter(rate_limit)
     for file in mtdt_files:
-        df = pd.read_csv(file).head(max_per_year)
+        df = pd.read_csv(file).head(int(max_per_year))
         year = df.loc[0,'Date_Priority'][:4]
         links = df.loc[:,'Link']
 
@@ -43,16 +282,35 @@ def download_from_mtdt(metadata_dir:Path, pdf_dir:Path, overwrite=True, max_per_
 
         save_dir = pdf_dir / Path(year)
         save_dir.mkdir(parents=True, exist_ok=True)
-        for i, url in enumerate(links):
-            bar.update(i)
-
-            filename = f'{year}_{i}.pdf'
-            filepath = save_dir / Path(filename)
-            if not overwrite and filepath.exists():
-                continue
+        manifest = load_manifest(save_dir)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for i, url in enumerate(links):
+                filename = f'{year}_{i}.pdf'
+                filepath = save_dir / Path(filename)
+                future = executor.submit(
+                    sync_file,
+                    url,
+                    filepath,
+                    session,
+                    rate_limiter,
+                    manifest.get(filename),
+                    overwrite,
+                    revalidate,
+                )
+                futures[future] = filename
 
-            download = requests.get(url)
-            filepath.write_bytes(download.content)
+            status_counts = {}
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = future.result()
+                manifest[futures[future]] = entry
+                status_counts[entry["status"]] = status_counts.get(entry["status"], 0) + 1
+                bar.update(done)
+                # so that a crashed run keeps the records of its completed downloads
+                if done % MANIFEST_SAVE_EVERY == 0:
+                    save_manifest(save_dir, manifest)
 
+        save_manifest(save_dir, manifest)
         bar.finish()
+        print(f"Files by status: {status_counts}")
         print(f"Time elapsed: {time.time() - start_time}s")
@@ -1,4 +1,9 @@
 import pandas as pd
+import logging
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -17,6 +22,60 @@ def make_driver(driver_path:Path):
     return driver
 
 
+METADATA_FIELDS = [
+    "Name",
+    "Title",
+    "Active_Countries",
+    "Author",
+    "Link",
+    "Date_Priority",
+    "Date_Filed",
+    "Date_Published",
+    "Date_Granted",
+]
+
+
+def parse_results_page(html: str, base_url="https://patents.google.com/"):
+    """Extracts the metadata of every patent (with a pdf link) listed in a
+    Google Patents results page.
+
+    Pure function of the page html (e.g. `driver.page_source`, or a saved page).
+
+    Args:
+        html (str): html of the results page
+        base_url (str, optional): url against which relative links are resolved
+
+    Returns:
+        list: one dict per patent, with keys `METADATA_FIELDS`
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    records = []
+    for patent in soup.find_all("search-result-item"):
+        pdf_link = patent.find(class_="pdfLink")
+        if pdf_link is None:
+            continue
+        metadata_element = patent.find(class_="metadata")
+        link = urljoin(base_url, pdf_link["href"])
+        record = {field: "" for field in METADATA_FIELDS}
+        record["Name"] = link.split("/")[-1]
+        record["Title"] = patent.find(class_="result-title").find("span").decode_contents()
+        # Note that we could save not-active and unknown countries aswell
+        record["Active_Countries"] = " ".join(
+            x.decode_contents() for x in metadata_element.find_all(class_="active")
+        )
+        record["Author"] = (
+            metadata_element.select_one("span:nth-last-child(2)")
+            .find(id="htmlContent")
+            .decode_contents()
+        )
+        record["Link"] = link
+        for date in patent.find(class_="dates").decode_contents().split(" • "):
+            datetype, dateval = date.split(" ")
+            record["Date_" + datetype] = dateval
+        records.append(record)
+    return records
+
+
 def scrape_metadata(
     assignee: str, year: int, lang: str, driver, save_path: Path,pages=10,page_results=50
 ):
@@ -32,17 +91,7 @@ def scrape_metadata(
         save_path (Path): path of output csv file.
         pages (int, optional): number of result pages to scrape for each year.
     """
-    metadata = {
-        "Name": [],
-        "Title": [],
-        "Active_Countries": [],
-        "Author": [],
-        "Link": [],
-        "Date_Priority": [],
-        "Date_Filed": [],
-        "Date_Published": [],
-        "Date_Granted": [],
-    }
+    metadata = {field: [] for field in METADATA_FIELDS}
     for month in range(1, 13):
         for page in range(pages):
             URL = (
@@ -64,58 +113,17 @@ def scrape_metadata(
             except:
                 break
 
-            patents_in_page = driver.find_elements_by_tag_name("search-result-item")
-
-            for patent in patents_in_page:
-                if len(patent.find_elements_by_class_name("pdfLink")) == 0:
-                    continue
-                # print(f"Patent number {len(metadata['Name'])}")
-                metadata_element = patent.find_element_by_class_name("metadata")
-                ###print("Getting Name")
-                metadata["Name"].append(
-                    patent.find_element_by_class_name("pdfLink")
-                    .get_attribute("href")
-                    .split("/")[-1]
-                )
-                ###print("Getting Title")
-                metadata["Title"].append(
-                    patent.find_element_by_class_name("result-title")
-                    .find_element_by_tag_name("span")
-                    .get_attribute("innerHTML")
-                )
-                # Note that we could save not-active and unknown countries aswell
-                ###print("Getting Active_Countries")
-                active_countries = [
-                    x.get_attribute("innerHTML")
-                    for x in metadata_element.find_elements_by_class_name("active")
-                ]
-                metadata["Active_Countries"].append(" ".join(active_countries))
-                ###print("Getting Author")
-                metadata["Author"].append(
-                    metadata_element.find_element_by_css_selector(
-                        "span:nth-last-child(2)"
-                    )
-                    .find_element_by_id("htmlContent")
-                    .get_attribute("innerHTML")
-                )
-                ###print("Getting Link")
-                metadata["Link"].append(
-                    patent.find_element_by_class_name("pdfLink").get_attribute(
-                        "href"
-                    )
-                )
-                ###print("Getting Dates")
-                metadata["Date_Priority"].append("")
-                metadata["Date_Filed"].append("")
-                metadata["Date_Published"].append("")
-                metadata["Date_Granted"].append("")
-                for date in (
-                    patent.find_element_by_class_name("dates")
-                    .get_attribute("innerHTML")
-                    .split(" • ")
-                ):
-                    datetype, dateval = date.split(" ")
-                    metadata["Date_" + datetype][-1] = dateval
+            # one round trip to the browser, then offline parsing
+            html = driver.page_source
+            start = time.perf_counter()
+            records = parse_results_page(html)
+            parse_time = time.perf_counter() - start
+            logging.info(
+                f"Parsed page {page} of {month}/{year}: {len(records)} patents in {1000 * parse_time:.1f} ms"
+            )
+            for record in records:
+                for field in METADATA_FIELDS:
+                    metadata[field].append(record[field])
 
         print(
             f"Scraped month {month}/{year} for a total of {len(metadata['Link'])} entries."
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import inspect
+from pathlib import Path
+
+from data_pipeline.pdf_download import file_sha256
+
+
+class Stage:
+    """Fingerprint ledger of a pipeline stage.
+
+    Every output of the stage is recorded with the fingerprint of the input
+    it was computed from, and with the stage version (a hash of the stage
+    code and configuration). An output is up to date if it exists, and
+    both its input fingerprint and the stage version are unchanged.
+
+    Input fingerprints are the SHA-256 of the file content, cached on
+    (size, mtime), so an unchanged file is never hashed twice.
+
+    Args:
+        name (str): stage name, used for the ledger file name.
+        ledger_dir (Path): directory of the ledger files.
+        code (module or function): code of the stage, hashed in the version.
+        config (dict, optional): stage configuration, hashed in the version.
+    """
+
+    def __init__(self, name: str, ledger_dir: Path, code, config: dict = None):
+        self.name = name
+        self.ledger_file = ledger_dir / Path(name + ".json")
+        version = hashlib.sha256(inspect.getsource(code).encode())
+        version.update(json.dumps(config or {}, sort_keys=True, default=str).encode())
+        self.version = version.hexdigest()
+        self.hits = 0
+        self.recomputes = 0
+
+        self.hashes = {}
+        self.outputs = {}
+        if self.ledger_file.exists():
+            with open(self.ledger_file) as f_stream:
+                ledger = json.load(f_stream)
+            self.hashes = ledger["hashes"]
+            self.outputs = ledger["outputs"]
+
+    def fingerprint(self, path: Path) -> str:
+        stat = path.stat()
+        key = path.as_posix()
+        cached = self.hashes.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = file_sha256(path)
+        self.hashes[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def is_fresh(self, src: Path, dest: Path) -> bool:
+        record = self.outputs.get(dest.as_posix())
+        return (
+            record is not None
+            and dest.exists()
+            and record["version"] == self.version
+            and record["input"] == self.fingerprint(src)
+        )
+
+    def plan(self, jobs, overwrite=False):
+        """Returns the `(src, dest)` jobs whose output is not up to date
+        (all of them if `overwrite` is True), counting the other ones as hits.
+        """
+        stale = [job for job in jobs if overwrite or not self.is_fresh(*job)]
+        self.hits += len(jobs) - len(stale)
+        self.recomputes += len(stale)
+        return stale
+
+    def record(self, jobs):
+        """Records the `(src, dest)` jobs as computed by the current
+        stage version, and saves the ledger."""
+        for src, dest in jobs:
+            self.outputs[dest.as_posix()] = {
+                "input": self.fingerprint(src),
+                "version": self.version,
+            }
+        self.save()
+
+    def save(self):
+        self.ledger_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.ledger_file.with_name(self.ledger_file.name + ".part")
+        with open(tmp_file, "w") as f_stream:
+            json.dump({"hashes": self.hashes, "outputs": self.outputs}, f_stream)
+        os.replace(tmp_file, self.ledger_file)
+
+    def summary(self) -> str:
+        return f"Stage {self.name}: {self.hits} up to date, {self.recomputes} recomputed"
@@ -0,0 +1,286 @@
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+    ALL_COMPLETED,
+)
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+from data_pipeline.pdf_download import make_session, download_file, HostRateLimiter
+from data_pipeline.pdf2txt import extract_text, spaces_regex
+from data_pipeline.clean_txt import (
+    clean_str,
+    init_cleaner,
+    ensure_nltk_data,
+    check_fast_tokenizer,
+    lemma_cache,
+)
+from utils.corpus_store import corpus_append, id_dates, APPEND_BATCH
+
+
+def download_doc(item, session, rate_limiter):
+    """Download stage: (name, url, pdf path) -> (name, pdf path)"""
+    name, url, pdf_path = item
+    if pdf_path.exists():
+        return name, pdf_path
+    entry = download_file(url, pdf_path, session, rate_limiter)
+    if entry["status"] == "failed":
+        return None
+    return name, pdf_path
+
+
+def convert_doc(item, backend, txt_dir: Path = None, keep_pdf=True):
+    """Convert stage: (name, pdf path) -> (name, text).
+    The text is also saved in `txt_dir`, if set."""
+    name, pdf_path = item
+    try:
+        txt, _ = extract_text(pdf_path, backend)
+    finally:
+        if not keep_pdf:
+            pdf_path.unlink(missing_ok=True)
+    if txt is None:
+        logging.info(f" No text extracted from {name}")
+        return None
+    txt = spaces_regex.sub(" ", txt)
+    if txt_dir is not None:
+        with open(txt_dir / Path(name + ".txt"), "w", errors="replace") as text_file:
+            text_file.write(txt)
+    return name, txt
+
+
+def clean_doc(item, dest_dir: Path, fast=False):
+    """Clean stage: (name, text) -> (name, text, cleaned text, new lemma cache entries).
+    The cleaned text is saved in `dest_dir`."""
+    name, txt = item
+    cleaned = clean_str(txt, fast)
+    with open(dest_dir / Path(name + ".txt"), "w", errors="replace") as text_file:
+        text_file.write(cleaned)
+    return name, txt, cleaned, lemma_cache.pop_new()
+
+
+def run_stage(
+    func, in_queue, out_queue, executor, max_inflight, stop_event=None, poll_interval=0.05
+):
+    """Feeds the items of `in_queue` to `func` on `executor`, and puts the
+    results in `out_queue` as soon as they complete.
+
+    At most `max_inflight` items are submitted at once, so a slow downstream
+    stage blocks this one instead of letting its queue grow. While waiting
+    for input, completed items are handed downstream every `poll_interval`
+    seconds. Items for which `func` fails or returns None are dropped.
+    A None item marks the end of the stream. It is forwarded to `out_queue`
+    once every submitted item is done, or as soon as the stage fails
+    (e.g. its pool breaks) or `stop_event` is set (e.g. the consumer of the
+    last stage failed), so the downstream stages never hang.
+    """
+    inflight = set()
+    ended = False
+
+    def collect(timeout=None, return_when=FIRST_COMPLETED):
+        nonlocal inflight
+        done, inflight = wait(inflight, timeout=timeout, return_when=return_when)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.warning(f"{func.func.__name__}: {e}")
+                continue
+            if result is not None:
+                out_queue.put(result)
+
+    try:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                for future in inflight:
+                    future.cancel()
+                break
+            if len(inflight) >= max_inflight:
+                collect()
+                continue
+            try:
+                item = in_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                collect(timeout=0)
+                continue
+            if item is None:
+                ended = True
+                break
+            inflight.add(executor.submit(func, item))
+            collect(timeout=0)
+        if ended:
+            collect(return_when=ALL_COMPLETED)
+    except Exception:
+        logging.exception(f"{func.func.__name__} stage failed")
+    finally:
+        # drain the input, so that the upstream stage is not blocked
+        if not ended:
+            for _ in iter(in_queue.get, None):
+                pass
+        out_queue.put(None)
+
+
+def stream_pipeline(
+    metadata_dir: Path,
+    clean_dir: Path,
+    pdf_dir: Path = None,
+    txt_dir: Path = None,
+    overwrite=False,
+    max_per_year=1e4,
+    download_workers=8,
+    rate_limit=None,
+    convert_processes=None,
+    clean_processes=None,
+    queue_size=64,
+    backend="tika",
+    fast=False,
+    lemma_cache_file: Path = None,
+    corpus_db: Path = None,
+):
+    """Downloads, converts and cleans the patents linked in the metadata files,
+    streaming every document through the three stages.
+
+    Each stage has its own pool (threads for downloading, processes for
+    converting and cleaning), and the stages are connected by queues of
+    at most `queue_size` documents, so network-bound and cpu-bound work overlap.
+    The new lemma cache entries of the clean workers are merged and saved
+    to `lemma_cache_file`. There is no OCR fallback: pdfs without text
+    layer are skipped (use the batch convert stage for them).
+
+    Args:
+        metadata_dir (Path): dir containing metadata files
+        clean_dir (Path): dir where the cleaned txts are saved
+        pdf_dir (Path, optional): if set, the pdfs are kept in this dir.
+            Otherwise, they are deleted once converted.
+        txt_dir (Path, optional): if set, the uncleaned txts are saved in this dir.
+        overwrite (bool, optional): If False (default), patents with a cleaned
+            txt already in `clean_dir` are skipped.
+        max_per_year (int, optional): max number of pdfs per metadata file.
+        download_workers (int, optional): number of download threads.
+        rate_limit (float, optional): max requests per second to each host.
+        convert_processes (int, optional): number of convert processes.
+            Defaults to the number of cpus.
+        clean_processes (int, optional): number of clean processes.
+            Defaults to the number of cpus.
+        queue_size (int, optional): max documents waiting between two stages.
+        backend (str, optional): text-extraction backend (see `pdf2txt.BACKENDS`).
+        fast (bool, optional): Use the fast tokenizer (see `clean_str`), after
+            checking it with `check_fast_tokenizer`, as `batch_clean` does.
+        lemma_cache_file (Path, optional): json file of the lemma cache.
+        corpus_db (Path, optional): if set, the documents are also appended
+            to this corpus store (see `utils.corpus_store`).
+    """
+    ensure_nltk_data()
+    # the parent cache collects the entries of the workers
+    init_cleaner(lemma_cache_file)
+    if fast:
+        check_fast_tokenizer()
+    clean_dir.mkdir(parents=True, exist_ok=True)
+    if txt_dir is not None:
+        txt_dir.mkdir(parents=True, exist_ok=True)
+    keep_pdf = pdf_dir is not None
+    tmp_dir = None
+    if not keep_pdf:
+        tmp_dir = tempfile.TemporaryDirectory()
+        pdf_dir = Path(tmp_dir.name)
+
+    jobs = []
+    for file in metadata_dir.glob("*.csv"):
+        df = pd.read_csv(file).head(int(max_per_year))
+        year = df.loc[0, "Date_Priority"][:4]
+        (pdf_dir / Path(year)).mkdir(parents=True, exist_ok=True)
+        for i, url in enumerate(df.loc[:, "Link"]):
+            name = f"{year}_{i}"
+            if not overwrite and (clean_dir / Path(name + ".txt")).exists():
+                continue
+            jobs.append((name, url, pdf_dir / Path(year) / Path(name + ".pdf")))
+    print(f"Streaming {len(jobs)} documents")
+
+    pdf_queue = queue.Queue(queue_size)
+    txt_queue = queue.Queue(queue_size)
+    done_queue = queue.Queue(queue_size)
+    # unbounded: it is filled upfront, and the download stage throttles itself
+    job_queue = queue.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    job_queue.put(None)
+
+    session = make_session(download_workers)
+    convert_processes = convert_processes or os.cpu_count()
+    clean_processes = clean_processes or os.cpu_count()
+    executors = [
+        ThreadPoolExecutor(download_workers),
+        ProcessPoolExecutor(convert_processes),
+        ProcessPoolExecutor(
+            clean_processes, initializer=init_cleaner, initargs=(lemma_cache_file,)
+        ),
+    ]
+    workers = [download_workers, convert_processes, clean_processes]
+    stages = [
+        (partial(download_doc, session=session, rate_limiter=HostRateLimiter(rate_limit)), job_queue, pdf_queue),
+        (partial(convert_doc, backend=backend, txt_dir=txt_dir, keep_pdf=keep_pdf), pdf_queue, txt_queue),
+        (partial(clean_doc, dest_dir=clean_dir, fast=fast), txt_queue, done_queue),
+    ]
+
+    start_time = time.time()
+    first_doc_time = None
+    stop_event = threading.Event()
+    threads = []
+    for (func, in_queue, out_queue), executor, n in zip(stages, executors, workers):
+        # keep every worker busy, with one item ready to go
+        max_inflight = 2 * n
+        thread = threading.Thread(
+            target=run_stage, args=(func, in_queue, out_queue, executor, max_inflight, stop_event)
+        )
+        thread.start()
+        threads.append(thread)
+
+    dates = id_dates(metadata_dir) if corpus_db is not None else {}
+    records = []
+    n_done = 0
+    stream_ended = False
+    try:
+        for name, txt, cleaned, new_lemmas in iter(done_queue.get, None):
+            n_done += 1
+            lemma_cache.update(new_lemmas)
+            if first_doc_time is None:
+                first_doc_time = time.time() - start_time
+            if n_done % 100 == 0:
+                logging.info(f"{n_done}/{len(jobs)} documents done")
+            if corpus_db is not None:
+                date = dates[name]
+                records.append((name, int(date[:4]), date[:7], txt, cleaned))
+                if len(records) >= APPEND_BATCH:
+                    corpus_append(corpus_db, records)
+                    records = []
+        stream_ended = True
+        if corpus_db is not None:
+            corpus_append(corpus_db, records)
+        if lemma_cache_file is not None:
+            lemma_cache.save(lemma_cache_file)
+    finally:
+        if not stream_ended:
+            # stop the stages, and unblock the last one
+            stop_event.set()
+            for _ in iter(done_queue.get, None):
+                pass
+        for thread in threads:
+            thread.join()
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    print(f"Cleaned documents: {n_done}/{len(jobs)}")
+    if first_doc_time is not None:
+        print(f"Time to first cleaned document: {first_doc_time:.1f}s")
+    print(f"Time elapsed: {time.time() - start_time:.1f}s")
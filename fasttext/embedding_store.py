@@ -0,0 +1,123 @@
+import fasttext
+import numpy as np
+import json
+import os
+
+# vocabulary rows scored at once: memory is O(block_size x queries)
+BLOCK_SIZE = 8192
+
+
+def export_model(model_path, store_dir, dtype=np.float16):
+    """Exports the word vectors of a fasttext model to `store_dir`:
+    `vectors.npy`, the (words x dim) matrix of unit-normalized word vectors
+    (as used by `get_nearest_neighbors`) in `dtype`, and `words.json`,
+    the vocabulary in row order.
+    """
+    model = fasttext.load_model(model_path)
+    words = model.words
+    os.makedirs(store_dir, exist_ok=True)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(store_dir, "vectors.npy"),
+        mode="w+",
+        dtype=dtype,
+        shape=(len(words), model.get_dimension()),
+    )
+    for start in range(0, len(words), BLOCK_SIZE):
+        block = np.stack([model.get_word_vector(w) for w in words[start : start + BLOCK_SIZE]])
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        vectors[start : start + BLOCK_SIZE] = block / np.maximum(norms, 1e-12)
+    vectors.flush()
+    with open(os.path.join(store_dir, "words.json"), "w") as f_stream:
+        json.dump(words, f_stream)
+
+
+def export_models(model_folder, store_folder, dtype=np.float16):
+    """Exports every `<name>.bin` model of `model_folder` to `store_folder/<name>`,
+    unless its export is newer than the model."""
+    for fname in sorted(os.listdir(model_folder)):
+        if not fname.endswith(".bin"):
+            continue
+        model_path = os.path.join(model_folder, fname)
+        store_dir = os.path.join(store_folder, fname[:-4])
+        vectors_path = os.path.join(store_dir, "vectors.npy")
+        if os.path.isfile(vectors_path) and os.path.getmtime(vectors_path) >= os.path.getmtime(model_path):
+            continue
+        print(f"Exporting model {fname[:-4]}.")
+        export_model(model_path, store_dir, dtype)
+
+
+class EmbeddingStore:
+    """Word vectors exported with `export_model`, memory-mapped: opening a
+    store only reads its vocabulary."""
+
+    def __init__(self, store_dir):
+        self.vectors = np.load(os.path.join(store_dir, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(store_dir, "words.json")) as f_stream:
+            self.words = json.load(f_stream)
+        self.word_index = {w: i for i, w in enumerate(self.words)}
+
+    def rows(self, words):
+        """Row of every word, -1 for the words out of the vocabulary."""
+        return np.array([self.word_index.get(w, -1) for w in words], dtype=np.int64)
+
+    def nearest_neighbors(self, words, k=10, block_size=BLOCK_SIZE):
+        """Top-k nearest neighbours (cosine similarity) of a batch of words.
+
+        The vocabulary is scored block by block against all the query words
+        (one matrix product per block), keeping the running top k.
+
+        Returns:
+            list: for every word, list of (similarity, neighbour), as
+            fasttext's `get_nearest_neighbors` (empty for unknown words)
+        """
+        rows = self.rows(words)
+        known = np.flatnonzero(rows >= 0)
+        queries = np.asarray(self.vectors[rows[known]], dtype=np.float32)
+        scores = np.empty((len(known), 0), dtype=np.float32)
+        indexes = np.empty((len(known), 0), dtype=np.int64)
+        for start in range(0, len(self.words), block_size):
+            block = np.asarray(self.vectors[start : start + block_size], dtype=np.float32)
+            block_scores = queries @ block.T
+            # a word is not its own neighbour
+            local = rows[known] - start
+            inside = np.flatnonzero((local >= 0) & (local < block.shape[0]))
+            block_scores[inside, local[inside]] = -np.inf
+            block_indexes = np.broadcast_to(np.arange(start, start + block.shape[0]), block_scores.shape)
+            scores = np.hstack([scores, block_scores])
+            indexes = np.hstack([indexes, block_indexes])
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                indexes = np.take_along_axis(indexes, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        indexes = np.take_along_axis(indexes, order, axis=1)
+
+        neighbors = [[] for _ in words]
+        for q, i in enumerate(known):
+            neighbors[i] = [
+                (float(s), self.words[j]) for s, j in zip(scores[q], indexes[q]) if s > -np.inf
+            ]
+        return neighbors
+
+
+def open_stores(store_folder, names=None):
+    """Opens the embedding stores of `store_folder` (all of them, or `names`)."""
+    if names is None:
+        names = sorted(os.listdir(store_folder))
+    return {name: EmbeddingStore(os.path.join(store_folder, name)) for name in names}
+
+
+def nearest_neighbors(stores, words, k=10):
+    """Top-k nearest neighbours of a batch of words in several models.
+
+    Args:
+        stores (dict): model name -> `EmbeddingStore` (see `open_stores`)
+        words (list): query words
+        k (int, optional): neighbours per word. Defaults to 10.
+
+    Returns:
+        dict: model name -> list of neighbours of every word
+        (see `EmbeddingStore.nearest_neighbors`)
+    """
+    return {name: store.nearest_neighbors(words, k) for name, store in stores.items()}
@@ -1,87 +1,238 @@
 import fasttext
-import glob
 import progressbar
 import os
 import pandas as pd
-import codecs
-
-def concatenate_txt(output_path, glob_filter=None, filenames=None, description=""):
-    if filenames is None:
-        filenames = glob.glob(glob_filter)
-
-    with codecs.open(output_path, 'w', "utf-8") as outfile:
-        bar_widgets = [description, progressbar.Percentage(), progressbar.Bar()]
-        bar = progressbar.ProgressBar(widgets=bar_widgets, maxval=len(filenames)).start()
-        for i in range(len(filenames)):
-            fname = filenames[i]
-            bar.update(i)
-            if not os.path.isfile(fname):
-                continue
-            with open(fname) as infile:
-                for line in infile:
-                    outfile.write(line.lower())
-
-        bar.finish()
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from embedding_store import export_models
+
+# characters read and written at once by `agglomerate`
+BLOCK_SIZE = 1 << 20
+FINGERPRINTS_FILE = "fingerprints.json"
+# hyperparameters of `fasttext.train_unsupervised` (fasttext defaults)
+TRAIN_PARAMS = {"model": "skipgram", "dim": 100, "epoch": 5, "minCount": 5, "ws": 5}
+TRAIN_LEDGER_FILE = "train_ledger.json"
+
+def year_index(metadata_csv, clean_dir):
+    """Maps every cleaned txt of `clean_dir` listed in the merged metadata
+    file to its year (from the priority date)."""
+    df = pd.read_csv(metadata_csv, usecols=["Name", "Date_Priority"])
+    index = {}
+    for name, date in zip(df["Name"], df["Date_Priority"]):
+        index[os.path.join(clean_dir, name[:-4] + ".txt")] = str(date)[:4]
+    return index
+
+
+def fingerprint_files(filenames):
+    """Fingerprint of a list of input files, from their name, size and modification time."""
+    sha = hashlib.sha256()
+    for fname in filenames:
+        if os.path.isfile(fname):
+            stat = os.stat(fname)
+            sha.update(f"{fname}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+
+def agglomerate(metadata_csv, clean_dir, output_dir, block_size=BLOCK_SIZE):
+    """Writes the full text agglomerate (`full_text.txt`) and the agglomerate
+    of every year (`<year>_text.txt`) in a single pass over the cleaned corpus.
+
+    Every file is read once, in blocks of `block_size` characters, and each
+    lowercased block is written to the full agglomerate and to the one of
+    its year. Documents are separated by a newline.
+    An output is only rewritten if the fingerprint of its input files changed
+    (fingerprints are kept in `output_dir/fingerprints.json`).
+
+    Returns:
+        list: names of the rewritten outputs
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index = year_index(metadata_csv, clean_dir)
+    filenames = sorted(index)
+    inputs = {"full_text.txt": filenames}
+    for fname in filenames:
+        inputs.setdefault(index[fname] + "_text.txt", []).append(fname)
+
+    fingerprints_path = os.path.join(output_dir, FINGERPRINTS_FILE)
+    fingerprints = {}
+    if os.path.isfile(fingerprints_path):
+        with open(fingerprints_path) as f_stream:
+            fingerprints = json.load(f_stream)
+    stale = {}
+    for output, files in inputs.items():
+        fingerprint = fingerprint_files(files)
+        output_path = os.path.join(output_dir, output)
+        if fingerprints.get(output) != fingerprint or not os.path.isfile(output_path):
+            stale[output] = fingerprint
+    if not stale:
+        print("All agglomerates up to date.")
+        return []
+
+    outfiles = {
+        output: open(os.path.join(output_dir, output), "w", encoding="utf-8", buffering=block_size)
+        for output in stale
+    }
+    read_files = [f for f in filenames if "full_text.txt" in stale or index[f] + "_text.txt" in stale]
+    bar_widgets = ["Agglomerating files ", progressbar.Percentage(), progressbar.Bar()]
+    bar = progressbar.ProgressBar(widgets=bar_widgets, maxval=len(read_files)).start()
+    for i, fname in enumerate(read_files):
+        bar.update(i)
+        if not os.path.isfile(fname):
+            continue
+        targets = [outfiles[o] for o in ("full_text.txt", index[fname] + "_text.txt") if o in outfiles]
+        with open(fname) as infile:
+            for block in iter(lambda: infile.read(block_size), ""):
+                block = block.lower()
+                for outfile in targets:
+                    outfile.write(block)
+        for outfile in targets:
+            outfile.write("\n")
+    bar.finish()
+    for outfile in outfiles.values():
+        outfile.close()
+
+    fingerprints.update(stale)
+    with open(fingerprints_path, "w") as f_stream:
+        json.dump(fingerprints, f_stream, indent=1)
+    return list(stale)
+
+
+def input_stats(input_path, block_size=BLOCK_SIZE):
+    """Returns the SHA-256 and the number of words of a text agglomerate,
+    read in blocks of `block_size` bytes."""
+    sha = hashlib.sha256()
+    n_words = 0
+    prev_in_word = False
+    with open(input_path, "rb") as f_stream:
+        for block in iter(lambda: f_stream.read(block_size), b""):
+            sha.update(block)
+            n_words += len(block.split())
+            # a word split across two blocks is counted twice
+            if prev_in_word and not block[:1].isspace():
+                n_words -= 1
+            prev_in_word = not block[-1:].isspace()
+    return sha.hexdigest(), n_words
+
+
+def train_model(input_path, model_path, params, threads, n_words):
+    """Trains and saves a fasttext model on `input_path` (of `n_words` words)
+    with `threads` threads.
+
+    Returns:
+        dict: training time (s) and words processed per second
+    """
+    start = time.perf_counter()
+    model = fasttext.train_unsupervised(input_path, thread=threads, **params)
+    seconds = time.perf_counter() - start
+    model.save_model(model_path)
+    return {"seconds": seconds, "words_per_s": n_words * params.get("epoch", 5) / seconds}
+
+
+def train_all(jobs, model_folder, params=TRAIN_PARAMS, thread_budget=None):
+    """Trains fasttext models in parallel, under a total thread budget.
+
+    Jobs are scheduled largest input first. Each job gets a share of the
+    budget proportional to its input size (at least one thread), and is
+    started as soon as enough threads are free.
+    A model is skipped when it exists and both the hash of its input and
+    the hyperparameters are unchanged since it was trained. Input hash,
+    hyperparameters, status, training time and words/s of every model are
+    recorded in `model_folder/train_ledger.json`. A failed model is
+    recorded with status "failed" and its error, and does not stop the others.
+
+    Args:
+        jobs (list): tuples of input agglomerate path, model name
+        model_folder (str): directory of the models (`<name>.bin`)
+        params (dict, optional): `train_unsupervised` hyperparameters
+        thread_budget (int, optional): total threads. Defaults to the number of CPUs.
+
+    Returns:
+        dict: ledger entry of every trained model
+    """
+    thread_budget = thread_budget or os.cpu_count()
+    os.makedirs(model_folder, exist_ok=True)
+    ledger_path = os.path.join(model_folder, TRAIN_LEDGER_FILE)
+    ledger = {}
+    if os.path.isfile(ledger_path):
+        with open(ledger_path) as f_stream:
+            ledger = json.load(f_stream)
+
+    pending = []
+    for input_path, name in jobs:
+        if not os.path.isfile(input_path):
+            print(f"No agglomerate for {name}, skipping.")
+            continue
+        input_sha, n_words = input_stats(input_path)
+        model_path = os.path.join(model_folder, name + ".bin")
+        entry = ledger.get(name, {})
+        if (
+            os.path.isfile(model_path)
+            and entry.get("status") == "trained"
+            and entry.get("input_sha") == input_sha
+            and entry.get("params") == params
+        ):
+            print(f"Model {name} up to date.")
+            continue
+        pending.append((os.path.getsize(input_path), input_path, name, model_path, input_sha, n_words))
+    if not pending:
+        return {}
+
+    pending.sort(reverse=True)
+    total_size = sum(job[0] for job in pending)
+    trained = {}
+    running = {}
+    free = thread_budget
+    with ProcessPoolExecutor(max_workers=thread_budget) as executor:
+        while pending or running:
+            # start the largest jobs that fit in the free threads
+            for job in list(pending):
+                size, input_path, name, model_path, input_sha, n_words = job
+                threads = min(thread_budget, max(1, round(thread_budget * size / total_size)))
+                if threads > free:
+                    continue
+                print(f"Training model {name} with {threads} threads.")
+                future = executor.submit(train_model, input_path, model_path, params, threads, n_words)
+                running[future] = (name, input_sha, threads)
+                pending.remove(job)
+                free -= threads
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, input_sha, threads = running.pop(future)
+                free += threads
+                entry = {"input_sha": input_sha, "params": params, "threads": threads}
+                try:
+                    entry.update(future.result(), status="trained")
+                    print(f"Model {name} trained in {entry['seconds']:.0f}s ({entry['words_per_s']:.0f} words/s).")
+                except Exception as e:
+                    # e.g. too little data in a year: the other models go on
+                    print(f"Model {name} failed: {e}")
+                    entry.update(status="failed", error=str(e))
+                trained[name] = entry
+                ledger[name] = entry
+                with open(ledger_path, "w") as f_stream:
+                    json.dump(ledger, f_stream, indent=1)
+    return trained
+
 
 if __name__ == "__main__":
-    ####    TEXT CONCATENATION
-    # Concatenates all files, if full file does not exist
-    output_path = "data/text_agglomerates/full_text.txt"
-    if len(glob.glob(output_path)) == 0:
-        print("No full text detected. Computing concatenated file.")
-        glob_filter = 'clean_texts/*.txt'
-        concatenate_txt(output_path=output_path, glob_filter=glob_filter, description="Concatenating files with filter " + glob_filter)
-        print("Full text agglomerate computed and saved.\n")
-    else:
-        print("Full text agglomerate found.\n")
-
-    # Concatenates all files by year, if they dont exist
-    if len(glob.glob('data/text_agglomerates/*.txt')) < 21:
-        print("Some year agglomerate text was not found. Computing concatenated files.")
-
-        # Loop each year
-        files = glob.glob('metadata/*.csv')
-        for file in files:
-            year_str = file[9:13]
-            output_path = "data/text_agglomerates/" + year_str + "_text.txt"
-
-            df = pd.read_csv(file)
-            filenames = ["clean_texts/" + x[:-4] + ".txt" for x in df.loc[:,'Name']]
-
-            concatenate_txt(output_path=output_path, filenames=filenames, description="Concatenating files from " + year_str + " ")
-
-        print("Year agglomerates computed and saved.\n")
-    else:
-        print("All year agglomerates found.\n")
+    ####    TEXT AGGLOMERATION
+    # Agglomerates the full text and every year in one pass over the cleaned texts,
+    # rewriting only the agglomerates whose input files changed
+    updated = agglomerate("metadata/metadata.csv", "clean_texts", "data/text_agglomerates")
+    print(f"{len(updated)} agglomerates computed and saved.\n")
 
     ####    MODEL TRAINING
-    # Trains fasttext on the agglomerates
+    # Trains fasttext on the agglomerates whose content or hyperparameters changed
     print("Training models:\n")
     model_folder = "data/fasttext/models"
 
-    # Full text model
-    model_path = model_folder + "/full_text.bin"
-    if os.path.isfile(model_path):
-        print(f"Full text model already found.")
-    else:
-        print(f"Training full text model.")
-        model = fasttext.train_unsupervised(f"data/text_agglomerates/full_text.txt")
-        print("Sample words:", model.words[:10])
-        model.save_model(model_path)
-
-    # Different years models
-    for year in range(2000, 2020):
-        model_path = model_folder + f"/{year}.bin"
-
-        if os.path.isfile(model_path):
-            print(f"Year {year} already found.")
-            continue
-        else:
-            print(f"\nTraining year {year}.")
-
-        #try:
-        model = fasttext.train_unsupervised(f"data/text_agglomerates/{year}_text.txt")
-        print("Sample words:", model.words[:10])
-        model.save_model(model_path)
-        #except:
-        #    print(f"Year {year} has insufficient data.")
+    # Full text model and different years models
+    jobs = [("data/text_agglomerates/full_text.txt", "full_text")]
+    jobs += [(f"data/text_agglomerates/{year}_text.txt", str(year)) for year in range(2000, 2020)]
+    train_all(jobs, model_folder)
+
+    # Memory-mapped word vectors, for fast neighbours queries (see embedding_store)
+    export_models(model_folder, "data/fasttext/vectors")
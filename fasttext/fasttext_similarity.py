@@ -1,22 +1,25 @@
-import fasttext
+from embedding_store import export_models, open_stores
 
 from wordcloud import WordCloud, STOPWORDS
 import matplotlib.pyplot as plt
 import pandas as pd
 
-model = fasttext.load_model('data/fasttext/models/full_text.bin')
-x = model.get_nearest_neighbors('intelligence', k=100)
-[print(j[1]) for j in x]
+if __name__ == "__main__":
+    # memory-mapped word vectors (exported once from the .bin models)
+    export_models("data/fasttext/models", "data/fasttext/vectors")
+    stores = open_stores("data/fasttext/vectors", ["full_text"])
+    x = stores["full_text"].nearest_neighbors(["intelligence"], k=100)[0]
+    [print(j[1]) for j in x]
 
-word_cloud = WordCloud(width=3840,height=2160, max_words=1628,relative_scaling=1,normalize_plurals=False)
-weights = dict()
-for word in x:
-    weights[word[1]] = word[0]
-print(weights.items())
-word_cloud.generate_from_frequencies(weights)
+    word_cloud = WordCloud(width=3840,height=2160, max_words=1628,relative_scaling=1,normalize_plurals=False)
+    weights = dict()
+    for word in x:
+        weights[word[1]] = word[0]
+    print(weights.items())
+    word_cloud.generate_from_frequencies(weights)
 
-plt.rcParams["figure.figsize"] = (20,14)
-plt.imshow(word_cloud, interpolation='bilinear')
-plt.axis("off")
-plt.savefig("data/wordclouds/ex.png")
-#plt.show()
+    plt.rcParams["figure.figsize"] = (20,14)
+    plt.imshow(word_cloud, interpolation='bilinear')
+    plt.axis("off")
+    plt.savefig("data/wordclouds/ex.png")
+    #plt.show()
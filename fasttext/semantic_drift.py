@@ -0,0 +1,78 @@
+from embedding_store import open_stores
+
+from scipy.linalg import orthogonal_procrustes
+import numpy as np
+import pandas as pd
+import os
+
+
+def shared_rows(source, target, max_words=None):
+    """Returns the words in the vocabularies of both stores, and their rows
+    in each of them. Only the `max_words` most frequent words of each
+    vocabulary are considered, if set (fasttext vocabularies are sorted by
+    frequency, and rare words have noisy vectors)."""
+    source_words = source.words[:max_words] if max_words else source.words
+    target_index = target.word_index
+    if max_words:
+        target_index = {w: i for w, i in target_index.items() if i < max_words}
+    words = [w for w in source_words if w in target_index]
+    source_rows = np.array([source.word_index[w] for w in words], dtype=np.int64)
+    target_rows = np.array([target_index[w] for w in words], dtype=np.int64)
+    return words, source_rows, target_rows
+
+
+def pair_drift(source, target, max_words=None):
+    """Semantic drift of every shared word between two embedding stores.
+
+    The source vectors of the shared words are aligned to the target ones
+    with an orthogonal Procrustes rotation (the two models are trained
+    independently, so their spaces are only equal up to a rotation);
+    the drift of a word is then 1 - cosine similarity of its aligned source
+    vector and its target vector, computed for all the words at once.
+
+    Returns:
+        pandas.Series: drift of every shared word
+    """
+    words, source_rows, target_rows = shared_rows(source, target, max_words)
+    A = np.asarray(source.vectors[source_rows], dtype=np.float32)
+    B = np.asarray(target.vectors[target_rows], dtype=np.float32)
+    R, _ = orthogonal_procrustes(A, B)
+    aligned = A @ R
+    cosine = np.einsum("ij,ij->i", aligned, B) / np.maximum(
+        np.linalg.norm(aligned, axis=1) * np.linalg.norm(B, axis=1), 1e-12
+    )
+    return pd.Series(1 - cosine, index=words)
+
+
+def drift_table(stores, names, max_words=None, min_years=1):
+    """Ranked word x year drift table over consecutive models.
+
+    Args:
+        stores (dict): model name -> `EmbeddingStore` (see `open_stores`)
+        names (list): models in chronological order, e.g. years
+        max_words (int, optional): see `shared_rows`. Defaults to None.
+        min_years (int, optional): words with drift values for fewer
+            years are dropped. Defaults to 1.
+
+    Returns:
+        pandas.Dataframe: Index: word, Columns: the years (drift since the
+        previous year, NaN if the word is missing in one of the two models)
+        and "Mean" (mean drift), sorted by decreasing mean drift
+    """
+    columns = {}
+    for previous, name in zip(names[:-1], names[1:]):
+        print(f"Computing drift {previous} -> {name}.")
+        columns[name] = pair_drift(stores[previous], stores[name], max_words)
+    table = pd.DataFrame(columns)
+    table = table[table.notna().sum(axis=1) >= min_years].copy()
+    table["Mean"] = table.mean(axis=1)
+    return table.sort_values("Mean", ascending=False)
+
+
+if __name__ == "__main__":
+    # per-year models exported with embedding_store.export_models
+    years = [str(year) for year in range(2000, 2020) if os.path.isdir(f"data/fasttext/vectors/{year}")]
+    stores = open_stores("data/fasttext/vectors", years)
+    table = drift_table(stores, years, max_words=20000, min_years=5)
+    table.to_csv("data/fasttext/drift.csv", index_label="Word")
+    print(table.head(30))
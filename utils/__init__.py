@@ -1,2 +1,4 @@
 from .utils import *
-from .txts_loading import df_from_txts_cached, df_from_txts
\ No newline at end of file
+from .txts_loading import df_from_txts_cached, df_from_txts, iter_txts, iter_texts
+from .corpus_store import corpus_load, corpus_append, corpus_append_txts
+from .inverted_index import InvertedIndex
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+from scipy.sparse import issparse
+
+
+def fingerprint_texts(texts) -> str:
+    """SHA-256 fingerprint of a text corpus (a sequence of strings)."""
+    sha = hashlib.sha256()
+    for text in texts:
+        encoded = text.encode(errors="replace")
+        sha.update(len(encoded).to_bytes(8, "little"))
+        sha.update(encoded)
+    return sha.hexdigest()
+
+
+def fingerprint_txts_dir(txts_dir: Path) -> str:
+    """Cheap fingerprint of a directory of txt files, based on the
+    name, size and modification time of every file."""
+    sha = hashlib.sha256()
+    for f in sorted(txts_dir.glob("**/*.txt")):
+        stat = f.stat()
+        sha.update(f"{f.relative_to(txts_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+
+def fingerprint_matrix(matrix) -> str:
+    """SHA-256 fingerprint of a dense or sparse matrix."""
+    sha = hashlib.sha256(str(matrix.shape).encode())
+    if issparse(matrix):
+        matrix = matrix.tocsr()
+        arrays = [matrix.data, matrix.indices, matrix.indptr]
+    else:
+        arrays = [np.asarray(matrix)]
+    for a in arrays:
+        sha.update(str(a.dtype).encode())
+        sha.update(np.ascontiguousarray(a).data)
+    return sha.hexdigest()
+
+
+class ArtifactCache:
+    """Content-addressed cache of computation outputs.
+
+    Every artifact is saved in `cache_dir/artifacts/<namespace>/<key>`, where the key
+    is a hash of everything the output depends on (input fingerprint and
+    parameters), so different configurations are kept side by side.
+    When the total size of the artifacts exceeds `max_bytes`, the least
+    recently used ones are evicted. Hit and miss counts are kept per
+    namespace in `cache_dir/artifacts/cache_stats.json`.
+
+    Args:
+        cache_dir (Path): cache directory
+        max_bytes (int, optional): disk budget. Defaults to None (no limit).
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes=None):
+        self.root = cache_dir / Path("artifacts")
+        self.max_bytes = max_bytes
+        self.stats_file = self.root / Path("cache_stats.json")
+
+    @staticmethod
+    def key(**parts) -> str:
+        """Hashes the keyword arguments (json-serializable) into a cache key."""
+        encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, namespace: str, key: str, load_func):
+        """Returns `load_func(artifact_dir)` if the artifact is cached,
+        otherwise None."""
+        artifact_dir = self.root / Path(namespace) / Path(key)
+        if not artifact_dir.exists():
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        # the directory mtime is the last-use time, for LRU eviction
+        os.utime(artifact_dir)
+        return load_func(artifact_dir)
+
+    def put(self, namespace: str, key: str, save_func, *outputs):
+        """Saves an artifact with `save_func(artifact_dir, *outputs)`,
+        then evicts old artifacts if the disk budget is exceeded."""
+        artifact_dir = self.root / Path(namespace) / Path(key)
+        tmp_dir = artifact_dir.with_name(key + ".part")
+        rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.parent.mkdir(parents=True, exist_ok=True)
+        save_func(tmp_dir, *outputs)
+        rmtree(artifact_dir, ignore_errors=True)
+        os.replace(tmp_dir, artifact_dir)
+        self.evict(keep=artifact_dir)
+
+    def artifacts(self):
+        """Returns a list of (artifact dir, size in bytes, last-use time)."""
+        artifacts = []
+        for artifact_dir in self.root.glob("*/*"):
+            if not artifact_dir.is_dir() or artifact_dir.name.endswith(".part"):
+                continue
+            size = sum(f.stat().st_size for f in artifact_dir.iterdir())
+            artifacts.append((artifact_dir, size, artifact_dir.stat().st_mtime))
+        return artifacts
+
+    def evict(self, keep: Path = None):
+        """Deletes least recently used artifacts until the cache fits in
+        `max_bytes`. The `keep` artifact is never evicted."""
+        if self.max_bytes is None:
+            return
+        artifacts = sorted(self.artifacts(), key=lambda a: a[2])
+        total = sum(size for _, size, _ in artifacts)
+        for artifact_dir, size, _ in artifacts:
+            if total <= self.max_bytes:
+                break
+            if artifact_dir == keep:
+                continue
+            logging.info(f"Evicting cached artifact {artifact_dir}")
+            rmtree(artifact_dir, ignore_errors=True)
+            total -= size
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counts of every namespace."""
+        if not self.stats_file.exists():
+            return {}
+        with open(self.stats_file) as f_stream:
+            return json.load(f_stream)
+
+    def _count(self, namespace: str, outcome: str):
+        stats = self.stats()
+        counts = stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.stats_file, "w") as f_stream:
+            json.dump(stats, f_stream, indent=1)
+        logging.info(f"{namespace} cache: {counts['hits']} hits, {counts['misses']} misses")
@@ -0,0 +1,112 @@
+import sqlite3
+from pathlib import Path
+import pandas as pd
+
+CORPUS_COLUMNS = ["Year", "Month", "Raw", "Text"]
+# files read and inserted per transaction
+APPEND_BATCH = 500
+
+
+def corpus_connect(db_path: Path):
+    """Opens the corpus store, creating it if needed.
+
+    The store is a SQLite table with columns "ID" (primary key), "Year",
+    "Month" ("YYYY-MM"), "Raw" (uncleaned text) and "Text" (cleaned text),
+    indexed by year, so that a single year is read without scanning the others.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS corpus ("
+        "ID TEXT PRIMARY KEY, Year INTEGER, Month TEXT, Raw TEXT, Text TEXT)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS corpus_year ON corpus (Year)")
+    return con
+
+
+def id_dates(metadata_dir: Path) -> dict:
+    """Maps each document ID (`{year}_{i}`, as named by `download_from_mtdt`)
+    to the priority date found in the metadata files of `metadata_dir`.
+    """
+    dates = {}
+    for file in metadata_dir.glob("*.csv"):
+        df = pd.read_csv(file, usecols=["Date_Priority"])
+        year = df.loc[0, "Date_Priority"][:4]
+        for i, date in enumerate(df["Date_Priority"]):
+            dates[f"{year}_{i}"] = date
+    return dates
+
+
+def corpus_append(db_path: Path, records):
+    """Inserts or replaces documents in the corpus store.
+
+    Args:
+        db_path (Path): corpus store file
+        records (iterable): tuples of ID, Year, Month, Raw text, cleaned Text
+    """
+    con = corpus_connect(db_path)
+    with con:
+        con.executemany("INSERT OR REPLACE INTO corpus VALUES (?, ?, ?, ?, ?)", records)
+    con.close()
+
+
+def corpus_append_txts(db_path: Path, clean_files, raw_dir: Path = None, metadata_dir: Path = None):
+    """Appends cleaned txt files (and their uncleaned versions in `raw_dir`,
+    if set) to the corpus store.
+
+    Year and Month come from the metadata priority date if `metadata_dir` is
+    set, otherwise the year is read from the ID prefix.
+
+    Args:
+        db_path (Path): corpus store file
+        clean_files (iterable): cleaned txt files
+        raw_dir (Path, optional): dir containing the uncleaned txt files
+        metadata_dir (Path, optional): dir containing metadata files
+    """
+    dates = id_dates(metadata_dir) if metadata_dir is not None else {}
+    batch = []
+    for f in clean_files:
+        doc_id = f.stem
+        date = dates.get(doc_id)
+        year = int(date[:4]) if date else int(doc_id[:4])
+        month = date[:7] if date else None
+        text = f.read_text(errors="replace")
+        raw = None
+        if raw_dir is not None and (raw_dir / f.name).exists():
+            raw = (raw_dir / f.name).read_text(errors="replace")
+        batch.append((doc_id, year, month, raw, text))
+        if len(batch) >= APPEND_BATCH:
+            corpus_append(db_path, batch)
+            batch = []
+    corpus_append(db_path, batch)
+
+
+def corpus_load(db_path: Path, columns=("Text",), years=None):
+    """Loads documents from the corpus store.
+
+    Only the requested columns, and the rows of the requested years, are read.
+
+    Args:
+        db_path (Path): corpus store file
+        columns (list, optional): columns to load, among "Year", "Month",
+            "Raw" and "Text". Defaults to ("Text",).
+        years (list, optional): years to load. Defaults to None (all years).
+
+    Returns:
+        pandas.Dataframe: dataframe. Index: "ID", Columns: `columns`
+    """
+    columns = list(columns)
+    for c in columns:
+        if c not in CORPUS_COLUMNS:
+            raise ValueError(f"ERROR: invalid corpus column: {c}")
+    query = f"SELECT {', '.join(['ID'] + columns)} FROM corpus"
+    params = []
+    if years is not None:
+        years = [int(y) for y in years]
+        query += f" WHERE Year IN ({', '.join('?' * len(years))})"
+        params = years
+    query += " ORDER BY ID"
+    con = corpus_connect(db_path)
+    df = pd.read_sql_query(query, con, params=params, index_col="ID")
+    con.close()
+    return df
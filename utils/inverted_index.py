@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from shutil import rmtree
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from utils.corpus_store import id_dates
+
+# same tokens as sklearn's CountVectorizer, so that index counts match
+# the counts of `get_TopicDict_counts`
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+# documents indexed in memory before being written as a segment
+SEGMENT_DOCS = 1000
+DOCS_NAME = "docs.json"
+SEGMENT_ARRAYS = ["offsets", "docs", "tfs", "pos_offsets", "positions"]
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_postings(doc_tokens, positions=True):
+    """Builds the postings of a batch of tokenized documents.
+
+    Args:
+        doc_tokens (list): tuples of document number, tokens list
+        positions (bool, optional): keep the token positions. Defaults to True.
+
+    Returns:
+        tuple of terms list, dict of arrays:
+        - "offsets": postings of term t are in [offsets[t], offsets[t + 1])
+        - "docs", "tfs": document number and term frequency of every posting
+        - "pos_offsets", "positions": positions of posting p are
+          positions[pos_offsets[p]:pos_offsets[p + 1]]
+    """
+    vocab = {}
+    term_ids, doc_nums, lengths = [], [], []
+    for doc_num, tokens in doc_tokens:
+        term_ids += [vocab.setdefault(t, len(vocab)) for t in tokens]
+        doc_nums.append(doc_num)
+        lengths.append(len(tokens))
+    lengths = np.array(lengths, dtype=np.int64)
+    term = np.array(term_ids, dtype=np.int32)
+    doc = np.repeat(np.array(doc_nums, dtype=np.int32), lengths)
+    pos = np.arange(len(term), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    order = np.lexsort((pos, doc, term))
+    term, doc, pos = term[order], doc[order], pos[order].astype(np.int32)
+    # first token of every (term, document) pair
+    is_start = np.ones(len(term), dtype=bool)
+    is_start[1:] = (np.diff(term) != 0) | (np.diff(doc) != 0)
+    starts = np.flatnonzero(is_start).astype(np.int64)
+    pos_offsets = np.append(starts, len(term))
+    arrays = {
+        "offsets": np.searchsorted(term[starts], np.arange(len(vocab) + 1)).astype(np.int64),
+        "docs": doc[starts],
+        "tfs": np.diff(pos_offsets).astype(np.int32),
+        "pos_offsets": pos_offsets if positions else np.zeros(1, dtype=np.int64),
+        "positions": pos if positions else np.zeros(0, dtype=np.int32),
+    }
+    return list(vocab), arrays
+
+
+class Segment:
+    """Immutable part of the index, as memory-mapped arrays (see `build_postings`)."""
+
+    def __init__(self, seg_dir: Path):
+        self.seg_dir = seg_dir
+        with open(seg_dir / Path("terms.json")) as f_stream:
+            self.terms = json.load(f_stream)
+        self.term_index = {t: i for i, t in enumerate(self.terms)}
+        for name in SEGMENT_ARRAYS:
+            setattr(self, name, np.load(seg_dir / Path(name + ".npy"), mmap_mode="r"))
+
+    @staticmethod
+    def write(seg_dir: Path, terms: list, arrays: dict):
+        """Writes a segment, atomically."""
+        tmp_dir = seg_dir.with_name(seg_dir.name + ".part")
+        rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        with open(tmp_dir / Path("terms.json"), "w") as f_stream:
+            json.dump(terms, f_stream)
+        for name in SEGMENT_ARRAYS:
+            np.save(tmp_dir / Path(name + ".npy"), arrays[name])
+        # leftover of an interrupted update, not referenced by the index
+        rmtree(seg_dir, ignore_errors=True)
+        os.replace(tmp_dir, seg_dir)
+
+    def postings(self, term: str):
+        """Returns the posting numbers, documents and frequencies of `term`."""
+        t = self.term_index.get(term)
+        if t is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        start, end = self.offsets[t], self.offsets[t + 1]
+        return np.arange(start, end), np.asarray(self.docs[start:end]), np.asarray(self.tfs[start:end])
+
+    def term_positions(self, posting: int):
+        return np.asarray(self.positions[self.pos_offsets[posting] : self.pos_offsets[posting + 1]])
+
+    def expand(self):
+        """Returns every posting as arrays of terms, documents, frequencies."""
+        term = np.repeat(np.arange(len(self.terms), dtype=np.int32), np.diff(self.offsets))
+        return term, np.asarray(self.docs), np.asarray(self.tfs)
+
+
+class InvertedIndex:
+    """Persistent inverted index of a txt corpus: term -> postings
+    (document, term frequency and, optionally, token positions).
+
+    The index is a list of immutable segments, stored as numpy arrays and
+    memory-mapped when opened, plus the documents table `docs.json`
+    (ID, year, month, size and mtime of every indexed file).
+    `update` indexes only new or modified files, in new segments: the old
+    postings of a modified file are masked (its document number is listed
+    as deleted), and dropped by `compact`, which merges all the segments into one.
+
+    Documents are tokenized like sklearn's `CountVectorizer` does by default,
+    so keyword counts match the counts of `get_TopicDict_counts`.
+
+    Args:
+        index_dir (Path): index directory
+        positions (bool, optional): keep token positions, needed for phrase
+            lookups. Only used when creating the index. Defaults to True.
+    """
+
+    def __init__(self, index_dir: Path, positions=True):
+        self.index_dir = index_dir
+        docs_file = index_dir / Path(DOCS_NAME)
+        if docs_file.exists():
+            with open(docs_file) as f_stream:
+                self.table = json.load(f_stream)
+        else:
+            self.table = {
+                "positions": positions,
+                "segments": [],
+                "ids": [],
+                "years": [],
+                "months": [],
+                "stamps": [],
+                "deleted": [],
+            }
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(self.table["ids"])}
+        self.segments = [Segment(index_dir / Path(s)) for s in self.table["segments"]]
+        self._update_alive()
+
+    def _update_alive(self):
+        self.alive = np.ones(len(self.table["ids"]), dtype=bool)
+        self.alive[self.table["deleted"]] = False
+
+    def save(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        docs_file = self.index_dir / Path(DOCS_NAME)
+        tmp_file = docs_file.with_name(DOCS_NAME + ".part")
+        with open(tmp_file, "w") as f_stream:
+            json.dump(self.table, f_stream)
+        os.replace(tmp_file, docs_file)
+
+    def _new_segment_dir(self) -> Path:
+        n = max([int(s.split("_")[1]) for s in self.table["segments"]], default=0) + 1
+        return self.index_dir / Path(f"seg_{n:05d}")
+
+    def _add_segment(self, terms, arrays):
+        seg_dir = self._new_segment_dir()
+        Segment.write(seg_dir, terms, arrays)
+        self.table["segments"].append(seg_dir.name)
+        self.segments.append(Segment(seg_dir))
+        # the segment is only part of the index once the table refers to it
+        self.save()
+
+    def update(self, files, metadata_dir: Path = None):
+        """Indexes the new or modified txt files among `files`.
+
+        Year and Month come from the metadata priority date if `metadata_dir`
+        is set, otherwise the year is read from the ID prefix
+        (as `corpus_append_txts`).
+
+        Returns:
+            int: number of documents indexed
+        """
+        dates = id_dates(metadata_dir) if metadata_dir is not None else {}
+        batch = []
+        n_indexed = 0
+        for f in files:
+            doc_id = f.stem
+            stat = f.stat()
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            old = self.doc_index.get(doc_id)
+            if old is not None and self.alive[old] and self.table["stamps"][old] == stamp:
+                continue
+            if old is not None:
+                self.table["deleted"].append(old)
+            date = dates.get(doc_id)
+            doc_num = len(self.table["ids"])
+            self.doc_index[doc_id] = doc_num
+            self.table["ids"].append(doc_id)
+            self.table["years"].append(int(date[:4]) if date else int(doc_id[:4]))
+            self.table["months"].append(date[:7] if date else None)
+            self.table["stamps"].append(stamp)
+            batch.append((doc_num, tokenize(f.read_text(errors="replace"))))
+            n_indexed += 1
+            if len(batch) >= SEGMENT_DOCS:
+                self._add_segment(*build_postings(batch, self.table["positions"]))
+                batch = []
+        if batch:
+            self._add_segment(*build_postings(batch, self.table["positions"]))
+        self.save()
+        self._update_alive()
+        logging.info(f"Indexed {n_indexed} documents in {self.index_dir}")
+        return n_indexed
+
+    def compact(self):
+        """Merges all the segments into one, dropping the masked postings."""
+        if not self.segments:
+            return
+        logging.info(f"Compacting index {self.index_dir}...")
+        terms = sorted(set().union(*[s.terms for s in self.segments]))
+        term_index = {t: i for i, t in enumerate(terms)}
+        parts = []
+        for seg in self.segments:
+            local_to_global = np.array([term_index[t] for t in seg.terms], dtype=np.int32)
+            term, doc, tf = seg.expand()
+            kept = np.flatnonzero(self.alive[doc])
+            parts.append((seg, local_to_global[term[kept]], doc[kept], tf[kept], kept))
+
+        term = np.concatenate([p[1] for p in parts])
+        doc = np.concatenate([p[2] for p in parts])
+        tf = np.concatenate([p[3] for p in parts])
+        order = np.lexsort((doc, term))
+        arrays = {
+            "offsets": np.searchsorted(term[order], np.arange(len(terms) + 1)).astype(np.int64),
+            "docs": doc[order],
+            "tfs": tf[order],
+            "pos_offsets": np.zeros(1, dtype=np.int64),
+            "positions": np.zeros(0, dtype=np.int32),
+        }
+        if self.table["positions"]:
+            # gather the positions of every kept posting, in the new order
+            starts = np.concatenate([np.asarray(p[0].pos_offsets)[p[4]] for p in parts])
+            bases = np.cumsum([0] + [len(p[0].positions) for p in parts[:-1]])
+            starts = starts + np.repeat(bases, [len(p[4]) for p in parts])
+            all_positions = np.concatenate([np.asarray(p[0].positions) for p in parts])
+            starts, lengths = starts[order], tf[order].astype(np.int64)
+            pos_offsets = np.append(0, np.cumsum(lengths))
+            gather = np.repeat(starts - pos_offsets[:-1], lengths) + np.arange(pos_offsets[-1])
+            arrays["pos_offsets"] = pos_offsets
+            arrays["positions"] = all_positions[gather]
+
+        old_segments = self.table["segments"]
+        seg_dir = self._new_segment_dir()
+        Segment.write(seg_dir, terms, arrays)
+        self.table["segments"] = [seg_dir.name]
+        self.save()
+        self.segments = [Segment(seg_dir)]
+        for s in old_segments:
+            rmtree(self.index_dir / Path(s), ignore_errors=True)
+
+    @property
+    def n_docs(self) -> int:
+        return int(self.alive.sum())
+
+    def postings(self, term: str):
+        """Returns the document numbers and frequencies of `term`."""
+        docs, tfs = [], []
+        for seg in self.segments:
+            _, seg_docs, seg_tfs = seg.postings(term)
+            kept = self.alive[seg_docs]
+            docs.append(seg_docs[kept])
+            tfs.append(seg_tfs[kept])
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def phrase_postings(self, phrase: str):
+        """Returns the document numbers and occurences of `phrase`
+        (consecutive tokens). Requires an index with positions."""
+        if not self.table["positions"]:
+            raise ValueError("ERROR: phrase lookup requires an index with positions")
+        words = tokenize(phrase)
+        if len(words) == 1:
+            return self.postings(words[0])
+        docs, counts = [], []
+        for seg in self.segments:
+            word_postings = [seg.postings(w) for w in words]
+            common = word_postings[0][1]
+            for _, seg_docs, _ in word_postings[1:]:
+                common = np.intersect1d(common, seg_docs)
+            common = common[self.alive[common]]
+            for d in common:
+                # positions p of the first word such that word i is at p + i
+                starts = None
+                for i, (postings, seg_docs, _) in enumerate(word_postings):
+                    p = postings[np.searchsorted(seg_docs, d)]
+                    word_starts = seg.term_positions(p) - i
+                    starts = word_starts if starts is None else np.intersect1d(starts, word_starts)
+                if len(starts):
+                    docs.append(d)
+                    counts.append(len(starts))
+        return np.array(docs, dtype=np.int32), np.array(counts, dtype=np.int32)
+
+    def lookup(self, keyword: str):
+        """Postings of a keyword: a term, or a phrase if it has several tokens."""
+        words = tokenize(keyword)
+        if len(words) > 1:
+            return self.phrase_postings(keyword)
+        return self.postings(words[0] if words else "")
+
+    def count(self, keyword: str, max_count: int = None) -> int:
+        """Occurences of a keyword (term or phrase) in the corpus, with the
+        count per document capped at max_count (if set)."""
+        _, counts = self.lookup(keyword)
+        if max_count is not None:
+            counts = np.minimum(counts, max_count)
+        return int(counts.sum())
+
+    def count_matrix(self, keywords, max_count: int = None):
+        """Returns the sparse (documents x keywords) count matrix, over the
+        documents of `doc_ids()`, with counts capped at max_count (if set).
+        Same as `count_keywords` on the corpus, without scanning it."""
+        rows, cols, data = [], [], []
+        for j, keyword in enumerate(keywords):
+            docs, counts = self.lookup(keyword)
+            rows.append(docs)
+            cols.append(np.full(len(docs), j))
+            data.append(counts)
+        matrix = csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(self.table["ids"]), len(keywords)),
+        )
+        if max_count is not None:
+            np.minimum(matrix.data, max_count, out=matrix.data)
+        return matrix[self.alive]
+
+    def doc_ids(self) -> list:
+        """IDs of the indexed documents, in the order of `count_matrix` rows."""
+        return [doc_id for doc_id, alive in zip(self.table["ids"], self.alive) if alive]
+
+    def doc_periods(self, period="Year") -> np.ndarray:
+        """"Year" or "Month" of the indexed documents, in the order of `count_matrix` rows."""
+        if period not in ("Year", "Month"):
+            raise ValueError("ERROR: invalid value for period argument")
+        values = np.array(self.table["years" if period == "Year" else "months"], dtype=object)
+        return values[self.alive]
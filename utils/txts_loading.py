@@ -1,4 +1,5 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 def df_from_txts_cached(txts_dir, cache_dir):
@@ -18,28 +19,56 @@ def df_from_txts_cached(txts_dir, cache_dir):
 
 
 
-def df_from_txts(txts_dir):
+def read_txt(file: Path) -> str:
+    with open(file, errors="replace") as f_stream:
+        return f_stream.read()
+
+
+def iter_txts(txts_dir):
+    """Lazily yields `(ID, text)` for the txt files in a directory
+    (and sub-directories), sorted by path.
+
+    Only one text is in memory at a time, so the texts can be fed directly
+    to `tfidf_compute` (see `iter_texts`) without loading the corpus.
+
+    Args:
+        txts_dir (Path): directory containing the txt files
+    """
+    for f in sorted(txts_dir.glob("**/*.txt")):
+        yield f.stem, read_txt(f)
+
+
+def iter_texts(txts_dir):
+    """Like `iter_txts`, but yields only the texts."""
+    for _, text in iter_txts(txts_dir):
+        yield text
+
+
+def df_from_txts(txts_dir, threads=1):
     """Generate dataframe from txt files in a directory.
 
     Index "ID" will be the name of the txt file (stripped of the ".txt").
     Column "Text" is the file content.
+    Rows are sorted by path, as in `iter_txts`.
+    Files are read one after the other, or, if `threads` > 1, by a pool of
+    `threads` threads, which overlaps the file system latency of the many
+    small files (e.g. on a network filesystem or a cold disk).
 
     Args:
         txts_dir (Path): directory containing the txt files
+        threads (int, optional): number of reading threads. Defaults to 1.
 
     Returns:
         pandas.Dataframe: dataframe. Index: "ID", Columns: "Text"
     """
 
-    file_list = txts_dir.glob("**/*.txt")
-    doc_texts = {}
-
-    for f in file_list:
-        filename = f.stem
-        with open(f, errors="replace") as f_stream:
-            content = f_stream.read()
-        doc_texts[filename] = content
+    file_list = sorted(txts_dir.glob("**/*.txt"))
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            texts = list(executor.map(read_txt, file_list))
+    else:
+        texts = [read_txt(f) for f in file_list]
 
-    df = pd.DataFrame.from_dict(doc_texts, orient="index", columns=["Text"])
-    df.index.names = ["ID"]
-    return df
\ No newline at end of file
+    index = pd.Index([f.stem for f in file_list], name="ID")
+    df = pd.DataFrame({"Text": texts}, index=index)
+    return df
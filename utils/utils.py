@@ -1,8 +1,10 @@
 import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import CountVectorizer
+from scipy.sparse import csr_matrix
 from pathlib import Path
 import matplotlib.pyplot as plt
+import logging
 
 
 def merge_csv_files(csv_dir: Path, csv_result: Path):
@@ -61,6 +63,54 @@ def add_month_column(df, csv_metadata):
     return df
 
 
+def period_indicator(periods):
+    """Builds the sparse (documents x periods) indicator matrix of `periods`
+    (the period label of each document, e.g. year or "YYYY-MM" month).
+
+    Returns:
+        tuple of indicator matrix, sorted period labels
+    """
+    labels, period_index = np.unique(np.asarray(periods), return_inverse=True)
+    n_docs = len(period_index)
+    indicator = csr_matrix(
+        (np.ones(n_docs), (np.arange(n_docs), period_index)),
+        shape=(n_docs, len(labels)),
+    )
+    return indicator, labels
+
+
+def topic_keyword_matrix(TopicDict):
+    """Builds the sparse (keywords x topics) matrix mapping every keyword
+    count to the frequency of the topics it belongs to, with weight
+    1 / number of topic keywords (topic frequency = mean of its keywords
+    occurences). A keyword can belong to several topics.
+
+    Returns:
+        tuple of keywords list, keyword-topic matrix
+    """
+    words = list(dict.fromkeys(w for topic in TopicDict.values() for w in topic))
+    word_index = {w: i for i, w in enumerate(words)}
+    rows, cols, weights = [], [], []
+    for j, topic in enumerate(TopicDict.values()):
+        for w in topic:
+            rows.append(word_index[w])
+            cols.append(j)
+            weights.append(1 / len(topic))
+    keyword_topic = csr_matrix((weights, (rows, cols)), shape=(len(words), len(TopicDict)))
+    return words, keyword_topic
+
+
+def count_keywords(text_corpus, words, max_count: int = None):
+    """Returns the sparse (texts x keywords) count matrix of `words` in the
+    text corpus, with counts capped at max_count (if set)."""
+    counter_vectorizer = CountVectorizer(vocabulary=words)
+    txt_word_matrix = counter_vectorizer.fit_transform(text_corpus)
+    if max_count is not None:
+        # only the stored (non-zero) counts can exceed max_count
+        np.minimum(txt_word_matrix.data, max_count, out=txt_word_matrix.data)
+    return txt_word_matrix
+
+
 def get_TopicDict_counts(text_corpus, TopicDict, max_count: int = None):
     """For every topic, returns frequency in the text corpus.
 
@@ -76,31 +126,62 @@ def get_TopicDict_counts(text_corpus, TopicDict, max_count: int = None):
     Returns:
         list: occurences per topic.
     """
-    # concatenate topics keywords in one list
-    # so we can apply CountVectorizer just once (better performance)
-    words = []
-    for t in TopicDict:
-        words += TopicDict[t]
+    words, keyword_topic = topic_keyword_matrix(TopicDict)
+    txt_word_matrix = count_keywords(text_corpus, words, max_count)
+    topic_counts = np.asarray(txt_word_matrix.sum(axis=0)) @ keyword_topic
+    return list(np.ravel(topic_counts))
 
-    counter_vectorizer = CountVectorizer(vocabulary=words)
-    txt_word_matrix = counter_vectorizer.fit_transform(text_corpus)
-    word_txt_matrix = txt_word_matrix.transpose()
 
-    if max_count is not None:
-        tmp = word_txt_matrix > max_count
-        word_txt_matrix[tmp] = max_count
-
-    # sum along the txt axis
-    word_count_array = np.sum(word_txt_matrix, axis=1)
-    # for every topic, sum the respective words counts
-    topic_count_list = []
-    for topic in TopicDict.values():
-        matching_words = [(w in topic) for w in words]
-        matching_counts = word_count_array[matching_words]
-        topic_count = np.sum(matching_counts) / len(topic)
-        topic_count_list.append(topic_count)
-
-    return topic_count_list
+def get_TopicDict_trends(text_corpus, periods, TopicDict, max_count: int = None):
+    """For every topic and every period, returns frequency in the text corpus
+    (see `get_TopicDict_counts`), in a single pass over the corpus.
+
+    The whole corpus is vectorized once, then counts are aggregated with two
+    sparse products: keywords -> topics and texts -> periods.
+
+    Args:
+        text_corpus (list): text corpus, given as list of texts.
+        periods (list): period of each text, e.g. the "Year" or "Month"
+            column of the dataframe (see `add_year_column`, `add_month_column`).
+        TopicDict (dictionary): Key is topic name, Value is a list of the topic keywords.
+        max_count (int): if set, keyword count per text in corpus is capped at max_count.
+
+    Returns:
+        tuple of (topics x periods) occurences matrix, sorted period labels
+    """
+    words, keyword_topic = topic_keyword_matrix(TopicDict)
+    txt_word_matrix = count_keywords(text_corpus, words, max_count)
+    txt_period, labels = period_indicator(periods)
+    topic_period_counts = keyword_topic.T @ (txt_word_matrix.T @ txt_period)
+    return topic_period_counts.toarray(), labels
+
+
+def get_TopicDict_index_trends(index, TopicDict, max_count: int = None, period="Year"):
+    """Same as `get_TopicDict_trends`, over the documents of an inverted index
+    (see `utils.inverted_index`): keyword counts are read from the index
+    postings instead of scanning the corpus. Keywords can be phrases.
+
+    Args:
+        index (InvertedIndex): index of the text corpus
+        TopicDict (dictionary): Key is topic name, Value is a list of the topic keywords.
+        max_count (int): if set, keyword count per text in corpus is capped at max_count.
+        period (str, optional): "Year" (default) or "Month". Documents
+            without a month (indexed without metadata) are left out.
+
+    Returns:
+        tuple of (topics x periods) occurences matrix, sorted period labels
+    """
+    words, keyword_topic = topic_keyword_matrix(TopicDict)
+    txt_word_matrix = index.count_matrix(words, max_count)
+    periods = index.doc_periods(period)
+    # documents indexed without metadata have a year, but no month
+    dated = np.array([p is not None for p in periods], dtype=bool)
+    if not dated.all():
+        logging.warning(f"{np.sum(~dated)} documents without {period} are left out")
+        txt_word_matrix = txt_word_matrix[dated]
+    txt_period, labels = period_indicator(periods[dated])
+    topic_period_counts = keyword_topic.T @ (txt_word_matrix.T @ txt_period)
+    return topic_period_counts.toarray(), labels
 
 
 def unique_path(directory, name_pattern):